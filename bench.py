@@ -0,0 +1,293 @@
+'''
+Scaling benchmarks for sets.py.
+
+Each benchmark times one operation at sizes growing geometrically and
+fits the exponent k of t ~ n**k by least squares on a log-log scale.
+A benchmark fails when its exponent exceeds the bound declared for it
+here (except under --quick, whose three sizes are too few and small
+to fit it reliably), or, given the results of an earlier run, when it
+has grown by more than the tolerance since then.  Results are written as JSON so
+that runs on different commits can be compared:
+
+    python bench.py --output before.json
+    ...
+    python bench.py --output after.json --compare before.json
+
+'''
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+from sets import *
+
+
+BENCHMARKS = []
+
+
+def benchmark(bound, sizes):
+    '''
+    Register a benchmark.  The decorated function takes a size n and
+    returns a callable performing the operation at that size.
+
+    '''
+    def register(setup):
+        BENCHMARKS.append((setup.__name__, bound, sizes, setup))
+        return setup
+    return register
+
+
+def geometric(start, count, ratio=2):
+    return [int(start * ratio ** i) for i in range(count)]
+
+
+def shuffled(n, seed=0):
+    seq = list(range(n))
+    random.Random(seed).shuffle(seq)
+    return seq
+
+
+def chain(k):
+    '''Return the pairs of the total order <= on range(k).'''
+    return [(i, j) for i in range(k) for j in range(i, k)]
+
+
+def elements(n):
+    '''Return the number of elements of a chain with about n pairs.'''
+    return int(math.sqrt(2 * n))
+
+
+def blocks(n, size=4):
+    '''Return the equivalence on range(n) with classes of the given size.'''
+    return Relation([(i, j) for i in range(n)
+                            for j in range(i - i % size, i - i % size + size)])
+
+
+@benchmark(bound=1.3, sizes=geometric(2000, 6))
+def construction(n):
+    seq = shuffled(n)
+    return lambda: Set(seq)
+
+
+@benchmark(bound=1.2, sizes=geometric(2000, 6))
+def union(n):
+    A, B, C = Set(shuffled(n, 1)), Set(range(n // 2, 2 * n)), Set(range(0, 3 * n, 3))
+    return lambda: A | B | C
+
+
+@benchmark(bound=1.2, sizes=geometric(1000, 6))
+def intersect(n):
+    S = [Set(range(i, n + i)) for i in range(10)]
+    return lambda: S[0].intersect(*S[1:])
+
+
+@benchmark(bound=1.2, sizes=geometric(2000, 6))
+def difference(n):
+    A, B = Set(range(n)), Set(range(0, n, 2))
+    return lambda: A - B
+
+
+@benchmark(bound=1.2, sizes=geometric(2000, 6))
+def equality(n):
+    A, B = Set(range(n)), Set(shuffled(n))
+    return lambda: A == B and A == list(B)
+
+
+@benchmark(bound=1.2, sizes=geometric(2000, 6))
+def expression(n):
+    A, B = Set(range(n)), Set(range(n // 2, 2 * n))
+    C, D = Set(range(0, 3 * n, 3)), Set(range(0, n, 2))
+    return lambda: ((A.lazy() | B) & C - D).evaluate()
+
+
+@benchmark(bound=1.2, sizes=geometric(2 ** 10, 6))
+def powerset(n):
+    P = Set(range(int(math.log(n, 2)))).powerset()
+    return lambda: sum(1 for S in P)
+
+
+@benchmark(bound=1.3, sizes=[m * m for m in geometric(32, 5)])
+def product(n):
+    A = Set(range(int(math.sqrt(n))))
+    return lambda: (A * A).relation
+
+
+# blocks(64) is dense enough for the NumPy matrix check; start above 
+# it so that the sizes all time the same sparse path.  The Relation is 
+# built inside the timed call, as its queries cache what they compute.
+@benchmark(bound=1.3, sizes=geometric(128, 5))
+def transitive(n):
+    pairs = list(blocks(n))
+    return lambda: Relation(pairs).transitive
+
+
+# Here n counts the pairs of the chain, and the Relation is again 
+# built inside the timed call.
+@benchmark(bound=1.3, sizes=geometric(2000, 5))
+def comparable(n):
+    pairs = chain(elements(n))
+    return lambda: Relation(pairs).comparable
+
+
+@benchmark(bound=1.3, sizes=geometric(64, 5))
+def equivalence_classes(n):
+    R = blocks(n)
+    return lambda: R.equivalence_classes
+
+
+@benchmark(bound=1.3, sizes=geometric(2000, 5))
+def ordered_element(n):
+    k = elements(n)
+    pairs = chain(k)
+    def f():
+        x = Relation(pairs).element(k - 1)
+        return x.predecessors(), x.prev()
+    return f
+
+
+@benchmark(bound=1.3, sizes=geometric(2000, 5))
+def extremal(n):
+    pairs = [(i, i) for i in range(n)] + [(i, i + 1) for i in range(n - 1)]
+    def f():
+        R = Relation(pairs)
+        return R.first, R.last, R.maximals, R.minimals
+    return f
+
+
+@benchmark(bound=1.3, sizes=geometric(2000, 5))
+def compose(n):
+    R = Relation([(i, (i * 7) % n) for i in range(n)])
+    return lambda: R.compose(R).compose(R)
+
+
+@benchmark(bound=1.3, sizes=geometric(10 ** 4, 5))
+def compact_load(n):
+    pairs = [(i % 1000, i * 7 % n) for i in range(n)]
+    return lambda: CompactRelation(pairs)
+
+
+@benchmark(bound=1.2, sizes=geometric(2000, 6))
+def sample_space(n):
+    A, B = Set(range(0, n, 2)), Set(range(0, n, 3))
+    P = SampleSpace(Set(range(n)))
+    return lambda: (P(A), P(A, given=B), P(A & B))
+
+
+@benchmark(bound=1.3, sizes=geometric(2000, 5))
+def conditional(n):
+    P = SampleSpace(Set(range(n)), weights=dict((i, 1 + i % 3) for i in range(n)))
+    events = [P.event(range(i, n, 7)) for i in range(20)]
+    pairs = [(A, B) for A in events for B in events]
+    def f():
+        P._measures.clear()
+        return P.conditional(pairs)
+    return f
+
+
+@benchmark(bound=1.3, sizes=geometric(4000, 5))
+def event_family(n):
+    P = SampleSpace(Set(range(n)))
+    events = [P.event(range(i, n, 3 + i)) for i in range(50)]
+    return lambda: P.family(events).conditional
+
+
+def measure(f, floor=0.02, repeat=3):
+    '''Return the best time per call of f over a few timed batches.'''
+    number = 1
+    while True:
+        start = time.time()
+        for i in range(number):
+            f()
+        elapsed = time.time() - start
+        if elapsed >= floor:
+            break
+        number *= 2
+    best = elapsed
+    for i in range(repeat - 1):
+        start = time.time()
+        for i in range(number):
+            f()
+        best = min(best, time.time() - start)
+    return best / number
+
+
+def exponent(sizes, times):
+    '''Return the least squares slope of log(times) against log(sizes).'''
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    return sxy / sxx
+
+
+def run(names=None, quick=False):
+    results = {}
+    for name, bound, sizes, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if quick:
+            sizes = sizes[:3]
+        times = [measure(setup(n)) for n in sizes]
+        results[name] = {'sizes': sizes, 'times': times, 'bound': bound,
+                         'exponent': exponent(sizes, times)}
+    return results
+
+
+def check(results, baseline=None, tolerance=0.3, bounds=True):
+    '''
+    Return a list of failure messages for results, leaving out the 
+    bounds unless bounds is true.
+
+    '''
+    failures = []
+    for name in sorted(results):
+        k, bound = results[name]['exponent'], results[name]['bound']
+        if bounds and k > bound:
+            failures.append('{0}: exponent {1:.2f} exceeds bound {2:.2f}'
+                            .format(name, k, bound))
+        if baseline and name in baseline['results']:
+            old = baseline['results'][name]['exponent']
+            if k > old + tolerance:
+                failures.append('{0}: exponent {1:.2f} up from {2:.2f}'
+                                .format(name, k, old))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', help='results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--quick', action='store_true',
+                        help='run only the three smallest sizes, too few '
+                             'to hold the exponents to their bounds')
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.quick)
+    for name in sorted(results):
+        r = results[name]
+        print('{0:<20} k = {1:5.2f}  (bound {2:.2f}, {3:.2e}s at n = {4})'
+              .format(name, r['exponent'], r['bound'], r['times'][-1],
+                      r['sizes'][-1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'results': results},
+                  f, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    failures = check(results, baseline, args.tolerance, not args.quick)
+    for failure in failures:
+        print('FAIL ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,4 +16,4 @@ assert not R.symmetric
 assert R.transitive
 assert R.antisymmetric
 assert R.partial_order
-assert not R.total_order
+assert R.total_order
@@ -1,31 +1,431 @@
+import csv
+import math
+import random
+from array import array
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from heapq import merge as _heapmerge
+from itertools import chain, count, islice, product as _product
+from operator import itemgetter, lt
+
+__all__ = ['Set', 'FrozenSet', 'Universe', 'Expression', 'OrderedElement', 
+           'Relation', 'Poset', 'Partition', 'EquivalenceRelation', 
+           'CompactRelation', 'Ground', 'BitSet', 'CartesianProduct', 
+           'PowerSet', 'SampleSpace', 'EventFamily', 'SampledSpace']
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    _SCALARS = (int, long, float, str, unicode)
+except NameError:
+    _SCALARS = (int, float, str)
+_SCALAR_TYPES = frozenset(_SCALARS)
+
+try:
+    from itertools import izip as _zip
+except ImportError:
+    _zip = zip
+
+# Typecode of the integer arrays of a CompactRelation without NumPy; 
+# Python 2 has no 'q', but its 'l' is 64 bits wide on most platforms.
+try:
+    _ID = array('q').typecode
+except ValueError:
+    _ID = 'l'
+
+# A Relation switches to a NumPy boolean matrix for its property checks
+# when it has at most _DENSE_SIZE elements and at least _DENSITY of all
+# possible pairs.
+_DENSE_SIZE = 2048
+_DENSITY = 0.05
+
+# Masks are unpacked into NumPy matrices of about _BLOCK_CELLS entries 
+# at a time, a block of outcomes for all of them, and a SampleSpace 
+# keeps the measures of its _MEASURES most recently computed masks.
+_BLOCK_CELLS = 1 << 22
+_MEASURES = 4096
+
+# Set.update merges a batch of sorted scalars into the members in one 
+# pass once it has more than _MERGE_BATCH of them (or an eighth of the 
+# members): below that, inserting them one at a time is cheaper.
+_MERGE_BATCH = 512
+
+
+def _key(x):
+    '''
+    Return a hashable key standing in for x.
+
+    Hashable objects are their own key.  Lists (and so Sets) are 
+    read as sets and keyed by the frozenset of their members' keys; 
+    unhashable tuples are keyed componentwise.  Raise TypeError if 
+    x has no key.
+
+    '''
+    if isinstance(x, FrozenSet):
+        return x._frozenkey()
+    if isinstance(x, list):
+        return frozenset(_key(i) for i in x)
+    try:
+        hash(x)
+    except TypeError:
+        if isinstance(x, tuple):
+            return tuple(_key(i) for i in x)
+        raise
+    return x
+
+
+def _keyed(seq):
+    '''
+    Return (members, keys, loose) for seq with duplicates removed: 
+    the distinct members in order of first appearance, the set of 
+    their keys, and the members that have no key.
+
+    '''
+    members, keys, loose = [], set(), []
+    for i in seq:
+        try:
+            k = _key(i)
+        except TypeError:
+            if i not in loose:
+                loose.append(i)
+                members.append(i)
+            continue
+        if k not in keys:
+            keys.add(k)
+            members.append(i)
+    return members, keys, loose
+
+
+def _popcount(n):
+    '''Return the number of bits set in the non-negative int n.'''
+    return bin(n).count('1')
+
+
+def _bits(n):
+    '''Generate the positions of the bits set in n, lowest first.'''
+    while n:
+        low = n & -n
+        yield low.bit_length() - 1
+        n ^= low
+
+
+def _unpack(masks, n):
+    '''
+    Return a NumPy boolean matrix with a row for each of masks, whose 
+    column i is bit i of that mask, for bits 0 to n - 1.
+
+    '''
+    width = max((n + 7) // 8, 1)
+    data = b''.join(unhexlify('%0*x' % (2 * width, m)) for m in masks)
+    rows = numpy.frombuffer(data, numpy.uint8).reshape(len(masks), width)
+    return numpy.unpackbits(rows, axis=1)[:, ::-1][:, :n].astype(bool)
+
+
+def _blocks(masks, n, width):
+    '''
+    Generate (lo, M) for consecutive blocks of width bits covering 
+    bits 0 to n - 1, M the `_unpack` of masks restricted to the block 
+    starting at bit lo.
+
+    '''
+    for lo in range(0, n, width):
+        w = min(width, n - lo)
+        low = (1 << w) - 1
+        yield lo, _unpack([m >> lo & low for m in masks], w)
+
+
+def _width(rows):
+    '''Return the block width keeping `rows` unpacked masks small.'''
+    return max(_BLOCK_CELLS // max(rows, 1), 64)
+
+
+def _components(out):
+    '''
+    Return the strongly connected components of the graph on 
+    range(len(out)), where out[v] lists the successors of v, as lists 
+    of nodes in reverse topological order (Tarjan, without recursion).
+
+    '''
+    n = len(out)
+    index, low, onstack = [None] * n, [0] * n, [False] * n
+    stack, components, counter = [], [], 0
+    for root in range(n):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            v, i = work.pop()
+            if i == 0:
+                index[v] = low[v] = counter
+                counter += 1
+                stack.append(v)
+                onstack[v] = True
+            for j in range(i, len(out[v])):
+                w = out[v][j]
+                if index[w] is None:
+                    work.append((v, j + 1))
+                    work.append((w, 0))
+                    break
+                elif onstack[w]:
+                    low[v] = min(low[v], index[w])
+            else:
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        onstack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+    return components
+
+
+def _union_find(n, edges):
+    '''
+    Return the connected components of the graph on range(n) with 
+    the given (v, w) edges, ignoring direction: for each node, a 
+    representative of its component (union-find with union by size 
+    and path halving).
+
+    '''
+    parent, size = list(range(n)), [1] * n
+    for v, w in edges:
+        while parent[v] != v:
+            parent[v] = v = parent[parent[v]]
+        while parent[w] != w:
+            parent[w] = w = parent[parent[w]]
+        if v != w:
+            if size[v] < size[w]:
+                v, w = w, v
+            parent[w] = v
+            size[v] += size[w]
+    root = []
+    for v in range(n):
+        while parent[v] != v:
+            parent[v] = v = parent[parent[v]]
+        root.append(v)
+    return root
+
+
+def _scalar(x):
+    '''Return True if x is totally ordered consistently with ==.'''
+    if type(x) in _SCALAR_TYPES:
+        return True
+    if isinstance(x, tuple):
+        for i in x:
+            if type(i) not in _SCALAR_TYPES and not _scalar(i):
+                return False
+        return True
+    return isinstance(x, _SCALARS)
+
+
+def _merge_union(*seqs):
+    '''Return the union of sorted, distinct seqs as a sorted list.'''
+    out = []
+    for x in _heapmerge(*seqs):
+        if not out or out[-1] != x:
+            out.append(x)
+    return out
+
+
+def _merge_intersect(a, b):
+    '''Return the intersection of sorted, distinct a and b.'''
+    out = []
+    i, j, m, n = 0, 0, len(a), len(b)
+    while i < m and j < n:
+        x, y = a[i], b[j]
+        if x < y:
+            i += 1
+        elif y < x:
+            j += 1
+        else:
+            out.append(y)
+            i += 1
+            j += 1
+    return out
+
+
+def _merge_difference(a, b):
+    '''Return the members of sorted, distinct a not in b.'''
+    out = []
+    i, j, m, n = 0, 0, len(a), len(b)
+    while i < m and j < n:
+        x, y = a[i], b[j]
+        if x < y:
+            out.append(x)
+            i += 1
+        elif y < x:
+            j += 1
+        else:
+            i += 1
+            j += 1
+    out.extend(islice(a, i, None))
+    return out
+
+
+def _merge_xor(a, b):
+    '''Return the members of sorted, distinct a or b but not both.'''
+    out = []
+    i, j, m, n = 0, 0, len(a), len(b)
+    while i < m and j < n:
+        x, y = a[i], b[j]
+        if x < y:
+            out.append(x)
+            i += 1
+        elif y < x:
+            out.append(y)
+            j += 1
+        else:
+            i += 1
+            j += 1
+    out.extend(islice(a, i, None))
+    out.extend(islice(b, j, None))
+    return out
+
+
+def _merge_subset(a, b):
+    '''Return True if each member of sorted, distinct a is in b.'''
+    j, n = 0, len(b)
+    for x in a:
+        while j < n and b[j] < x:
+            j += 1
+        if j == n or x < b[j]:
+            return False
+        j += 1
+    return True
+
+
+def _ordered(*sets):
+    '''Return True if each of sets can take part in a sorted merge.'''
+    return all(isinstance(S, Set) and S._sorted() for S in sets)
+
+
+def _from_sorted(members):
+    '''Return a Set of sorted, distinct members without re-checking.'''
+    S = Set(members, reduce=False)
+    S._ordered = True
+    return S
+
+
+def _copy(S):
+    '''Return a copy of the Set S without re-checking its members.'''
+    if S._sorted():
+        return _from_sorted(list(S))
+    return Set(S, reduce=False)
+
+
+def _finite(X):
+    '''Return X as a Set.'''
+    return X if isinstance(X, Set) else Set(X)
+
+
+def _cofinite(diff):
+    '''Return the Universe minus the Set diff, which it takes over.'''
+    U = Universe.__new__(Universe)
+    U._diff = diff
+    return U
+
+
 class Set(list):
     '''
     Representation of a set.
+
+    Alongside the sorted list of members a Set keeps a hash index 
+    of their keys (see `_key`), so membership tests are O(1).  The 
+    index is dropped whenever the list is mutated and rebuilt on 
+    the next lookup.
+
+    When the members are scalars (numbers, strings and tuples of 
+    them) the sorted list is also strictly increasing, and union, 
+    intersection and (symmetric) difference run as linear merges.  
+    Anything else goes through the hash index.
     
     '''
     def __init__(self, seq=[], reduce=True):
-        members = []
+        index = None
         if reduce:
-            for i in seq: 
-                if i not in members: members.append(i) 
+            members, keys, loose = _keyed(seq)
+            index = (keys, loose)
         else:
             members = list(seq)
         super(Set, self).__init__(sorted(members))
+        self._index = index
+        self._ordered = None
+
+    def _changed(self):
+        '''Drop anything cached about the members.'''
+        self._index = None
+        self._ordered = None
+
+    def _sorted(self):
+        '''Return True if the members are strictly increasing scalars.'''
+        ordered = getattr(self, '_ordered', None)
+        if ordered is None:
+            try:
+                ordered = (all(map(_scalar, self)) and 
+                           all(map(lt, islice(self, max(len(self) - 1, 0)), 
+                                       islice(self, 1, None))))
+            except TypeError:
+                ordered = False
+            self._ordered = ordered
+        return ordered
+
+    def _lookup(self):
+        '''Return the (keys, loose) index, building it if needed.'''
+        index = getattr(self, '_index', None)
+        if index is None:
+            members, keys, loose = _keyed(self)
+            index = self._index = (keys, loose)
+        return index
+
+    def __contains__(self, x):
+        keys, loose = self._lookup()
+        try:
+            k = _key(x)
+        except TypeError:
+            return list.__contains__(self, x)
+        return k in keys or any(x == i for i in loose)
 
     def __and__(self, X):
+        if isinstance(X, Expression):
+            return NotImplemented
         return self.intersect(X)
 
     def __or__(self, X):
+        if isinstance(X, Expression):
+            return NotImplemented
         return self.union(X)
 
     def __sub__(self, X):
+        if isinstance(X, Expression):
+            return NotImplemented
         return self.difference(X)
 
     def __mul__(self, X):
         return self.product(X)
 
     def __xor__(self, X):
-        return self.union(X) - self.intersect(X)
+        if isinstance(X, Expression):
+            return NotImplemented
+        if isinstance(X, Universe):
+            return X ^ self
+        if _ordered(self, X):
+            try:
+                return _from_sorted(_merge_xor(self, X))
+            except TypeError:
+                pass
+        if not isinstance(X, Set):
+            X = Set(X)
+        return Set([i for i in self if i not in X] + 
+                   [i for i in X if i not in self], reduce=False)
 
     def __lt__(self, X):
         return self.issubset(X, proper=True)
@@ -40,38 +440,123 @@ class Set(list):
         return self.issuperset(X)
 
     def __eq__(self, X):
-        return all(x in self for x in X) and all(x in X for x in self)
+        if isinstance(X, Set):
+            if self._sorted() and X._sorted():
+                return len(self) == len(X) and list.__eq__(self, X)
+            keys, loose = X._lookup()
+        else:
+            try:
+                members, keys, loose = _keyed(X)
+            except TypeError:
+                return NotImplemented
+        mine, my_loose = self._lookup()
+        if len(keys) + len(loose) != len(mine) + len(my_loose):
+            return False
+        if not (loose or my_loose):
+            return keys == mine
+        return all(x in self for x in loose) and all(k in mine for k in keys)
+
+    def __ne__(self, X):
+        eq = self.__eq__(X)
+        return eq if eq is NotImplemented else not eq
 
     def __invert__(self):
-        U = Universe()
-        return U - self
+        return _cofinite(_copy(self))
+
+    def lazy(self):
+        '''Return the set as a deferred Expression.'''
+        return Expression('leaf', self)
+
+    def _replace(self, members, ordered=None):
+        '''Replace the members in place, keeping them sorted.'''
+        self._changed()
+        if not ordered:
+            try:
+                members = sorted(members)
+            except TypeError:
+                pass
+        list.__setitem__(self, slice(None), members)
+        self._ordered = ordered
 
     def add(self, x):
+        '''
+        Add x in place.  Sorted scalar members stay sorted by bisect 
+        insertion; anything else is appended.  The hash index is 
+        kept up to date rather than dropped.
+
+        '''
+        if x in self:
+            return
+        (keys, loose), ordered = self._lookup(), self._sorted()
+        self._changed()
+        if ordered and _scalar(x):
+            try:
+                list.insert(self, bisect_left(self, x), x)
+            except TypeError:
+                ordered = False
+                list.append(self, x)
+        else:
+            ordered = False
+            list.append(self, x)
+        try:
+            keys.add(_key(x))
+        except TypeError:
+            loose.append(x)
+        self._index, self._ordered = (keys, loose), ordered
+
+    def discard(self, x):
+        '''Remove x in place if it is a member.'''
         if x not in self:
-            self.append(x)
+            return
+        (keys, loose), ordered = self._lookup(), self._sorted()
+        self._changed()
+        if ordered:
+            i = bisect_left(self, x)
+        else:
+            for i, y in enumerate(self):
+                try:
+                    if _key(y) == _key(x):
+                        break
+                except TypeError:
+                    if y == x:
+                        break
+        y = self[i]
+        list.__delitem__(self, i)
+        try:
+            keys.discard(_key(y))
+        except TypeError:
+            loose.remove(y)
+        self._index, self._ordered = (keys, loose), ordered
 
     def equals(self, X): 
-        if len(self) != len(X):
-            return False
-        elif self.intersect(X) == self:
-            return True 
-        else:
-            return False
+        return self.__eq__(X) is True
+
+    def _size(self):
+        '''Return the number of distinct members.'''
+        if self._sorted():
+            return len(self)
+        keys, loose = self._lookup()
+        return len(keys) + len(loose)
 
     def issubset(self, X, proper=False):
+        if not hasattr(X, 'issuperset'):
+            X = Set(X)
         return X.issuperset(self, proper)
 
     def issuperset(self, X, proper=False):
-        if proper:
-            if not len(self) > len(X):
-                return False
-        else:
-            if not len(self) >= len(X):
-                return False
-        for i in X:
-            if i not in self:
-                return False
-        return True
+        if isinstance(X, Universe):
+            return False
+        if not isinstance(X, Set):
+            X = Set(X)
+        m, n = self._size(), X._size()
+        if n > m or (proper and n == m):
+            return False
+        if _ordered(self, X):
+            try:
+                return _merge_subset(X, self)
+            except TypeError:
+                pass
+        return all(i in self for i in X)
 
     def isdisjoint(self, *sets):
         if self.intersect(*sets):
@@ -80,38 +565,166 @@ class Set(list):
             return True
 
     def update(self, *sets):
-        return self.union(*sets)
+        '''
+        Add the members of each of sets in place.  Large batches of 
+        sorted scalars are merged in one pass; small ones, and 
+        anything else, go through `add`.
+
+        '''
+        sets = [S if isinstance(S, Set) else Set(S) for S in sets]
+        batch = sum(len(S) for S in sets)
+        if (batch > _MERGE_BATCH or batch * 8 > len(self)) and _ordered(self, *sets):
+            try:
+                members = _merge_union(self, *sets)
+            except TypeError:
+                members = None
+            if members is not None:
+                index = getattr(self, '_index', None)
+                self._replace(members, True)
+                if index is not None:
+                    for S in sets:
+                        index[0].update(S)
+                    self._index = index
+                return
+        for S in sets:
+            for x in S:
+                self.add(x)
+
+    def __ior__(self, X):
+        if isinstance(X, Universe):
+            return X | self
+        self.update(X)
+        return self
+
+    def __iand__(self, X):
+        if isinstance(X, Universe):
+            return self.__isub__(X._diff)
+        if not isinstance(X, Set):
+            X = Set(X)
+        if _ordered(self, X):
+            try:
+                self._replace(_merge_intersect(X, self), True)
+                return self
+            except TypeError:
+                pass
+        self._replace([i for i in self if i in X])
+        return self
+
+    def __isub__(self, X):
+        if isinstance(X, Universe):
+            return self.__iand__(X._diff)
+        if not isinstance(X, Set):
+            X = Set(X)
+        if _ordered(self, X):
+            try:
+                self._replace(_merge_difference(self, X), True)
+                return self
+            except TypeError:
+                pass
+        self._replace([i for i in self if i not in X])
+        return self
+
+    def __ixor__(self, X):
+        if isinstance(X, Universe):
+            return X ^ self
+        if not isinstance(X, Set):
+            X = Set(X)
+        if _ordered(self, X):
+            try:
+                self._replace(_merge_xor(self, X), True)
+                return self
+            except TypeError:
+                pass
+        self._replace([i for i in self if i not in X] + 
+                      [i for i in X if i not in self])
+        return self
 
     def union(self, *sets):
-        sets = self + list(sets)
+        sets = (self,) + sets
+        diffs = [S._diff for S in sets if isinstance(S, Universe)]
+        if diffs:
+            finite = [S for S in sets if not isinstance(S, Universe)]
+            D = diffs[0].intersect(*diffs[1:])
+            return _cofinite(D.difference(Set().union(*finite)))
+        if _ordered(*sets):
+            try:
+                return _from_sorted(_merge_union(*sets))
+            except TypeError:
+                pass
         return Set(i for S in sets for i in S)
 
     def intersect(self, *sets):
+        '''
+        Return the members common to self and each of sets.
+
+        The operands are visited smallest first, each one filtering 
+        what survived the ones before it, either by a sorted merge or 
+        by probing its hash index.  We stop as soon as nothing is left.
+
+        '''
         if not sets:
             return self
-        else:
-            first, rest = sets[0], sets[1:]
-            I = [i for i in first if i in self.intersect(*rest)]
-            return Set(I, reduce=False)
+        diffs = [S._diff for S in sets if isinstance(S, Universe)]
+        if diffs:
+            finite = [S for S in sets if not isinstance(S, Universe)]
+            return self.intersect(*finite).difference(Set().union(*diffs))
+        sets = [S if isinstance(S, Set) else Set(S) for S in sets]
+        sets = sorted([self] + sets, key=len)
+        I, rest = sets[0], sets[1:]
+        ordered = I._sorted()
+        for S in rest:
+            if not I:
+                break
+            if ordered and getattr(S, '_index', None) is None and S._sorted():
+                try:
+                    I = _merge_intersect(I, S)
+                    continue
+                except TypeError:
+                    pass
+            if ordered:
+                keys, loose = S._lookup()
+                I = [i for i in I if i in keys or i in loose]
+            else:
+                I = [i for i in I if i in S]
+        if ordered:
+            return _from_sorted(I)
+        return Set(I, reduce=False)
 
     def difference(self, X): 
+        if isinstance(X, Universe):
+            return self.intersect(X._diff)
+        # Lazy collections (products, power sets, ...) answer `in` 
+        # themselves; anything else is indexed first.
+        if isinstance(X, (list, tuple)) or not hasattr(X, '__contains__'):
+            X = _finite(X)
+        if _ordered(self, X):
+            try:
+                return _from_sorted(_merge_difference(self, X))
+            except TypeError:
+                pass
         return Set((i for i in self if i not in X), reduce=False)
 
-    def product(self, X):
-        return Relation([(i, j) for j in X for i in self], reduce=False)
+    def bitset(self, ground=None):
+        '''
+        Return the members as a BitSet over ground, which defaults 
+        to a Ground on the members themselves.
+
+        '''
+        if ground is None:
+            ground = Ground(self)
+        return ground.subset(self)
+
+    def product(self, *sets):
+        return CartesianProduct(self, *sets)
 
-    def powergen(self, set=None):
+    def powergen(self, set=None, frozen=False):
         if set is None: set = self
-        if set:
-            head, rest = set[:1], set[1:]
-            for e in self.powergen(rest):
-                yield Set(e)
-                yield Set(head + e)
-        else:
-            yield Set()
+        for S in PowerSet(set):
+            yield FrozenSet(S.set, reduce=False) if frozen else S.set
 
     def powerset(self, set=None):
-        return Set(self.powergen(), reduce=False)
+        if set is None: set = self
+        return PowerSet(set)
 
     def relation(self, cond):
         '''
@@ -124,58 +737,174 @@ class Set(list):
                                 for b in self if cond(a, b)])
 
 
+class FrozenSet(Set):
+    '''
+    Representation of an immutable set.
+
+    A FrozenSet is hashable.  Its hash is that of its key (see 
+    `_key`), computed once, so FrozenSets index directly inside 
+    other sets, and unequal FrozenSets are usually told apart by 
+    size and hash before any members are compared.
+
+    '''
+    def __init__(self, seq=[], reduce=True):
+        super(FrozenSet, self).__init__(seq, reduce)
+        self._frozen = None
+
+    def _changed(self):
+        raise TypeError("FrozenSet is immutable")
+
+    def _frozenkey(self):
+        '''Return the frozenset of member keys, computing it once.'''
+        if self._frozen is None:
+            keys, loose = self._lookup()
+            if loose:
+                raise TypeError("FrozenSet has members without a key")
+            self._frozen = frozenset(keys)
+        return self._frozen
+
+    def __hash__(self):
+        return hash(self._frozenkey())
+
+    def __eq__(self, X):
+        if isinstance(X, FrozenSet):
+            try:
+                k, j = self._frozenkey(), X._frozenkey()
+            except TypeError:
+                return super(FrozenSet, self).__eq__(X)
+            return len(k) == len(j) and hash(k) == hash(j) and k == j
+        return super(FrozenSet, self).__eq__(X)
+
+    def __reduce__(self):
+        # pickle and copy would otherwise refill the list through 
+        # extend, which a FrozenSet refuses.
+        return (type(self), (list(self), False))
+
+    def add(self, x):
+        self._changed()
+
+    discard = add
+
+    def update(self, *sets):
+        self._changed()
+
+
+def _mutator(name):
+    '''Wrap the list method `name` so that it calls `_changed`.'''
+    method = getattr(list, name)
+    def mutate(self, *args):
+        self._changed()
+        return method(self, *args)
+    mutate.__name__ = name
+    mutate.__doc__ = method.__doc__
+    return mutate
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 
+              'sort', 'reverse', '__setitem__', '__delitem__', 
+              '__setslice__', '__delslice__', '__iadd__', '__imul__'):
+    if hasattr(list, _name):
+        setattr(Set, _name, _mutator(_name))
+del _name
+
+
 class Universe(object):
     '''
     Universe has a set-like interface and implements set 
     operations consistently on the complements of finite sets.
+
+    A Universe holds everything outside the finite Set `_diff`, so 
+    membership is a lookup in the hash index of `_diff`.  Together 
+    with the Sets the Universes are closed under all the boolean 
+    operations, each of which comes down to a single operation on 
+    the finite sets involved, e.g. (U - D) | X = U - (D - X) and 
+    (U - D) & (U - E) = U - (D | E).  The in-place operations and 
+    `add`, `discard` and `update` change `_diff` in place.
     
     '''
     def __init__(self):
         self._diff = Set()
  
     def __sub__(self, other):
-        S = Universe()
-        if type(other) == Set:
-            S._diff = self._diff | other
-            return S
-        if type(other) == Universe:
-            return other._diff
-        else:
-            S._diff = self._diff | other._diff
-            return S
+        if isinstance(other, Expression):
+            return NotImplemented
+        if isinstance(other, Universe):
+            return other._diff - self._diff
+        return _cofinite(self._diff | _finite(other))
  
     def __rsub__(self, other):
-        return other & self._diff
+        return _finite(other) & self._diff
  
     def __contains__(self, obj):
         return not obj in self._diff
  
     def __and__(self, other):
-        return other - self._diff
+        if isinstance(other, Expression):
+            return NotImplemented
+        if isinstance(other, Universe):
+            return _cofinite(self._diff | other._diff)
+        return _finite(other) - self._diff
  
     def __rand__(self, other):
-        return other - self._diff
+        return self.__and__(other)
  
     def __repr__(self):
-        if self._diff == Set():
+        if not self._diff:
             return "Universe"
         else:
             return "Universe - {0}".format(self._diff)
  
     def __or__(self, other):
-        S = Universe()
-        S._diff = self._diff - other
-        return S
+        if isinstance(other, Expression):
+            return NotImplemented
+        if isinstance(other, Universe):
+            return _cofinite(self._diff & other._diff)
+        return _cofinite(self._diff - _finite(other))
  
     def __xor__(self, other):
-        return (self - other) | (other - self)
+        if isinstance(other, Expression):
+            return NotImplemented
+        if isinstance(other, Universe):
+            return self._diff ^ other._diff
+        return _cofinite(self._diff ^ _finite(other))
+
+    def __rxor__(self, other):
+        return self.__xor__(other)
  
     def add(self, elem):
-        if elem in self._diff:
-            self._diff.remove(elem)
+        self._diff.discard(elem)
+
+    def discard(self, elem):
+        self._diff.add(elem)
  
-    def update(self, other):
-        self._diff = self._diff - other
+    def update(self, *others):
+        '''Add the members of each of others in place.'''
+        for X in others:
+            if isinstance(X, Universe):
+                self._diff &= X._diff
+            else:
+                self._diff -= X
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        if isinstance(other, Universe):
+            self._diff |= other._diff
+            return self
+        return self & other
+
+    def __isub__(self, other):
+        if isinstance(other, Universe):
+            return self - other
+        self._diff |= other
+        return self
+
+    def __ixor__(self, other):
+        if isinstance(other, Universe):
+            return self ^ other
+        self._diff ^= other
+        return self
  
     def __ror__(self, other):
         return self.__or__(other)
@@ -192,43 +921,285 @@ class Universe(object):
     def symmetric_difference(self, other):
         return self.__xor__(other)
  
-    def issubset(self, other):
-        if type(other) == Set:
+    def issubset(self, other, proper=False):
+        if not isinstance(other, Universe):
             return False
-        if issubset(other._diff, self._diff):
-            return True
-        return False
+        return other._diff.issubset(self._diff, proper)
  
-    def issuperset(self, other):
-        if self._diff & other:
-            return False
-        return True
+    def issuperset(self, other, proper=False):
+        if isinstance(other, Universe):
+            return self._diff.issubset(other._diff, proper)
+        return self._diff.isdisjoint(other)
  
     def __lt__(self, other):
-        return self.issubset(other)
+        return self.issubset(other, proper=True)
  
     def __eq__(self, other):
-        if type(other) == Set:
-            return False
-        try:
-            return self._diff == other._diff
-        except AttributeError:
+        if not isinstance(other, Universe):
             return False
+        return self._diff == other._diff
  
     def __ne__(self, other):
         return not self.__eq__(other)
  
     def __le__(self, other):
-        return self.__lt__(other) or self.__eq__(other)
+        return self.issubset(other)
  
     def __gt__(self, other):
-        return self.issuperset(other)
+        return self.issuperset(other, proper=True)
  
-    def __gt__(self, other):
-        return self.issuperset(other) or self == other
+    def __ge__(self, other):
+        return self.issuperset(other)
+
+    def __invert__(self):
+        return _copy(self._diff)
+
+    def lazy(self):
+        '''Return the set as a deferred Expression.'''
+        return Expression('leaf', self)
+
+
+def _optimize(node, negate=False):
+    '''
+    Return the expression tree node (or its complement, if negate) 
+    rewritten over leaves, complements of leaves, and flat 'and', 
+    'or' and 'xor' nodes: differences become intersections with a 
+    complement and complements are pushed down to the leaves by De 
+    Morgan's laws.
+
+    '''
+    op, args = node
+    if op == 'leaf':
+        X = args[0]
+        if isinstance(X, Universe):
+            leaf = ('leaf', (X._diff,))
+            return leaf if negate else ('not', (leaf,))
+        return ('not', (node,)) if negate else node
+    if op == 'not':
+        return _optimize(args[0], not negate)
+    if op == 'sub':
+        a, b = args
+        if negate:
+            return _flatten('or', [_optimize(a, True), _optimize(b)])
+        return _flatten('and', [_optimize(a), _optimize(b, True)])
+    if op == 'xor':
+        return ('xor', (_optimize(args[0], negate), _optimize(args[1])))
+    if negate:
+        op = 'or' if op == 'and' else 'and'
+    return _flatten(op, [_optimize(a, negate) for a in args])
+
+
+def _flatten(op, args):
+    flat = []
+    for a in args:
+        flat.extend(a[1] if a[0] == op else [a])
+    return (op, tuple(flat))
+
+
+def _finite_node(node):
+    '''Return True if the optimized node denotes a finite set.'''
+    op, args = node
+    if op == 'leaf':
+        return True
+    if op == 'not':
+        return False
+    if op == 'and':
+        return any(map(_finite_node, args))
+    if op == 'or':
+        return all(map(_finite_node, args))
+    return _finite_node(args[0]) == _finite_node(args[1])
+
+
+def _estimate(node):
+    '''
+    Return an upper bound on the size of a finite node, or on the 
+    number of non-members of a cofinite one.
+
+    '''
+    op, args = node
+    if not _finite_node(node):
+        return _excluded(node)
+    if op == 'leaf':
+        return len(args[0])
+    if op == 'and':
+        return min(_estimate(a) for a in args if _finite_node(a))
+    return sum(_estimate(a) for a in args)
+
+
+def _tester(node):
+    '''Return a function testing membership in the optimized node.'''
+    op, args = node
+    if op == 'leaf':
+        return args[0].__contains__
+    if op == 'not':
+        f = _tester(args[0])
+        return lambda x: not f(x)
+    fs = [_tester(a) for a in args]
+    if op == 'and':
+        return lambda x: all(f(x) for f in fs)
+    if op == 'or':
+        return lambda x: any(f(x) for f in fs)
+    f, g = fs
+    return lambda x: f(x) != g(x)
+
+
+def _stream(node, inside=True):
+    '''
+    Generate, without repeats, the members of the finite optimized 
+    node if inside, or else the non-members of the cofinite one.
+
+    An intersection streams its smallest finite operand and tests 
+    each candidate against the others, smallest first; a union 
+    streams each of its operands in turn, skipping what the ones 
+    before it have produced.  Nothing is materialized on the way.
+
+    '''
+    op, args = node
+    if op == 'leaf':
+        return iter(args[0])
+    if op == 'not':
+        return _stream(args[0], not inside)
+    if op == 'xor':
+        # Anything wanted lies on the finite side of a or of b: among 
+        # the members of a finite operand or the non-members of a 
+        # cofinite one.
+        a, b = args
+        fa, fb = _tester(a), _tester(b)
+        sa, sb = _finite_node(a), _finite_node(b)
+        first = (x for x in _stream(a, sa) if (sa != fb(x)) == inside)
+        second = (x for x in _stream(b, sb) 
+                    if fa(x) != sa and (fa(x) != sb) == inside)
+        return chain(first, second)
+    if (op == 'and') == inside:
+        # The members of an intersection or the non-members of a 
+        # union: filter the smallest candidate stream by the rest.
+        candidates = [a for a in args if _finite_node(a) == inside]
+        source = min(candidates, key=_estimate)
+        rest = sorted((a for a in args if a is not source), 
+                      key=lambda a: _estimate(a) if _finite_node(a) == inside 
+                                    else float('inf'))
+        tests = [_tester(a) for a in rest]
+        if inside:
+            return (x for x in _stream(source, inside) 
+                      if all(f(x) for f in tests))
+        return (x for x in _stream(source, inside) 
+                  if not any(f(x) for f in tests))
+    # The members of a union or the non-members of an intersection, 
+    # all of whose operands are finite, or cofinite, respectively.
+    def merged():
+        tests = []
+        for a in args:
+            for x in _stream(a, inside):
+                if inside:
+                    fresh = not any(f(x) for f in tests)
+                else:
+                    fresh = all(f(x) for f in tests)
+                if fresh:
+                    yield x
+            tests.append(_tester(a))
+    return merged()
+
+
+def _excluded(node):
+    '''Return an upper bound on the non-members of a cofinite node.'''
+    op, args = node
+    if op == 'not':
+        return _estimate(args[0])
+    if op == 'or':
+        return min(_excluded(a) for a in args if not _finite_node(a))
+    return sum(_estimate(a) for a in args)
+
+
+class Expression(object):
+    '''
+    Representation of a deferred set expression.
+
+    `S.lazy()` wraps a Set or Universe S, and the set operators on 
+    an Expression (with a Set, a Universe or another Expression on 
+    either side) build a tree instead of computing anything.  
+    `evaluate` first rewrites the tree: differences become 
+    intersections with a complement, complements are pushed down to 
+    the leaves by De Morgan's laws, and nested intersections and 
+    unions are flattened.  It then streams the result in a single 
+    pass, testing each candidate against the hash indexes of the 
+    leaves, so no intermediate Sets are built.  Intersections are 
+    driven by their smallest operand.  Membership tests on an 
+    Expression do not evaluate it at all.
+
+    '''
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+
+    @staticmethod
+    def _wrap(X):
+        if isinstance(X, Expression):
+            return X
+        if not isinstance(X, Universe):
+            X = _finite(X)
+        return Expression('leaf', X)
+
+    def _tree(self):
+        if self.op == 'leaf':
+            return ('leaf', self.args)
+        return (self.op, tuple(a._tree() for a in self.args))
+
+    def __and__(self, X):
+        return Expression('and', self, Expression._wrap(X))
+
+    def __rand__(self, X):
+        return Expression('and', Expression._wrap(X), self)
+
+    def __or__(self, X):
+        return Expression('or', self, Expression._wrap(X))
+
+    def __ror__(self, X):
+        return Expression('or', Expression._wrap(X), self)
+
+    def __sub__(self, X):
+        return Expression('sub', self, Expression._wrap(X))
+
+    def __rsub__(self, X):
+        return Expression('sub', Expression._wrap(X), self)
+
+    def __xor__(self, X):
+        return Expression('xor', self, Expression._wrap(X))
+
+    def __rxor__(self, X):
+        return Expression('xor', Expression._wrap(X), self)
 
     def __invert__(self):
-        return self._diff
+        return Expression('not', self)
+
+    def __contains__(self, x):
+        return _tester(_optimize(self._tree()))(x)
+
+    def __repr__(self):
+        if self.op == 'leaf':
+            return repr(self.args[0])
+        if self.op == 'not':
+            return "~{0!r}".format(self.args[0])
+        symbol = {'and': '&', 'or': '|', 'sub': '-', 'xor': '^'}[self.op]
+        return "({0!r} {1} {2!r})".format(self.args[0], symbol, self.args[1])
+
+    def evaluate(self):
+        '''Return the value of the expression as a Set or a Universe.'''
+        node = _optimize(self._tree())
+        op, args = node
+        if op in ('or', 'xor') and all(a[0] == 'leaf' for a in args):
+            # A single union or symmetric difference of sorted leaves 
+            # is already one pass as a merge.
+            leaves = [a[1][0] for a in args]
+            if _ordered(*leaves):
+                try:
+                    if op == 'or':
+                        return _from_sorted(_merge_union(*leaves))
+                    return _from_sorted(_merge_xor(*leaves))
+                except TypeError:
+                    pass
+        if _finite_node(node):
+            return Set(_stream(node), reduce=False)
+        return _cofinite(Set(_stream(node, inside=False), reduce=False))
 
 
 class OrderedElement(object):
@@ -248,10 +1219,13 @@ class OrderedElement(object):
         return self.x != y
 
     def __lt__(self, y):
-        return self.x != y and (self.x, y) in self.R
+        return self.R.lt(self.x, y)
 
     def __le__(self, y):
-        return (self.x, y) in self.R
+        return self.R.le(self.x, y)
+
+    def __hash__(self):
+        return hash(self.x)
 
     def __bool__(self):
         return self.x
@@ -266,37 +1240,36 @@ class OrderedElement(object):
             return m <= self <= n
 
     def predecessors(self, strict=True):
-        if strict: 
-            return Set(e for e in self.R.elements if e < self)
-        else:
-            return Set(e for e in self.R.elements if e <= self)
+        return Set(self.R.element(e) 
+                   for e in self.R.predecessors(self.x, strict))
 
     def immediate_predecessors(self):
         '''Return the set of immediate predecessors.'''
-        P = self.predecessors(strict=True)
-        return Set(p for p in P if not any(p < q < self for q in P))
+        return Set(self.R.element(p) for p in self.R.covers(self.x))
 
     def prev(self):
         '''Return an immediate predecessor.'''
-        P = self.predecessors(strict=True)
-        for p in P:
-            if not any(p < q < self for q in P):
-                return p
+        for p in self.R.covers(self.x):
+            return self.R.element(p)
 
     def successors(self, strict=True):
-        return Set(e for e in self.R.elements if e > self)
+        return Set(self.R.element(e) 
+                   for e in self.R.successors(self.x, strict))
 
     def next(self):
         '''Return an immediate successor.'''
-        S = self.successors(strict=True)
-        for s in S:
-            if not any(self > q > s for q in S):
-                return s
+        for s in self.R.covered_by(self.x):
+            return self.R.element(s)
 
 
 class Relation(Set):
     '''
     Representation of a binary relation.
+
+    On first use a Relation builds an adjacency index mapping the key 
+    of each element (see `_key`) to its successors and predecessors, 
+    so that the queries below cost time proportional to their output.  
+    The index is dropped whenever the relation is mutated.
     
     '''
     def __init__(self, seq, **kwargs):
@@ -305,62 +1278,300 @@ class Relation(Set):
             assert len(i) == 2
         super(Relation, self).__init__(seq, **kwargs)
 
+    @classmethod
+    def _trusted(cls, pairs, reduce=True):
+        '''Return a relation of pairs known to be 2-tuples, unchecked.'''
+        R = cls.__new__(cls)
+        Set.__init__(R, pairs, reduce)
+        return R
+
+    def _changed(self):
+        super(Relation, self)._changed()
+        self._adjacency = None
+        self._digraph = None
+        self._dense = None
+        self._hasse = None
+        self._extremes = None
+        self.__dict__.pop('elems', None)
+
+    def _adjacent(self):
+        '''
+        Return (succ, pred, objs): dicts mapping the key of each 
+        element to the list of its successors, the list of its 
+        predecessors, and the element itself.
+
+        '''
+        adjacency = getattr(self, '_adjacency', None)
+        if adjacency is None:
+            succ, pred, objs = {}, {}, {}
+            if self._sorted():
+                keyed = ((x, y, x, y) for x, y in self)
+            else:
+                keyed = ((_key(x), _key(y), x, y) for x, y in self)
+            for kx, ky, x, y in keyed:
+                succ.setdefault(kx, []).append(y)
+                pred.setdefault(ky, []).append(x)
+                objs.setdefault(kx, x)
+                objs.setdefault(ky, y)
+            adjacency = self._adjacency = (succ, pred, objs)
+        return adjacency
+
+    def _graph(self):
+        '''
+        Return (nodes, out, position): the elements in a fixed order, 
+        the positions of the successors of each of them, and a dict 
+        from the key of each element to its position.
+
+        '''
+        graph = getattr(self, '_digraph', None)
+        if graph is None:
+            succ, pred, objs = self._adjacent()
+            keys = list(objs)
+            position = dict((k, i) for i, k in enumerate(keys))
+            nodes = [objs[k] for k in keys]
+            key = (lambda y: y) if self._sorted() else _key
+            out = [[position[key(y)] for y in succ.get(k, ())] for k in keys]
+            graph = self._digraph = (nodes, out, position)
+        return graph
+
+    def _matrix(self):
+        '''
+        Return the relation as a NumPy boolean adjacency matrix over 
+        the elements of `_graph`, or None if NumPy is missing or the 
+        relation is too large or too sparse for the matrix to pay off.
+
+        '''
+        dense = getattr(self, '_dense', None)
+        if dense is None:
+            M = None
+            nodes, out, position = self._graph()
+            n, m = len(nodes), sum(len(o) for o in out)
+            if numpy is not None and 0 < n <= _DENSE_SIZE and m >= _DENSITY * n * n:
+                rows = numpy.repeat(numpy.arange(n), [len(o) for o in out])
+                cols = numpy.fromiter(chain.from_iterable(out), numpy.intp, m)
+                M = numpy.zeros((n, n), dtype=bool)
+                M[rows, cols] = True
+            dense = self._dense = (M,)
+        return dense[0]
+
+    def le(self, x, y):
+        '''Return True if x R y.'''
+        return (x, y) in self
+
+    def lt(self, x, y):
+        '''Return True if x R y and x != y.'''
+        return x != y and (x, y) in self
+
+    def _condensed(self):
+        '''
+        Return (components, component): the strongly connected 
+        components of `_graph`, sinks first, and the index of the 
+        component of each element.
+
+        '''
+        nodes, out, position = self._graph()
+        components = _components(out)
+        component = [0] * len(nodes)
+        for c, C in enumerate(components):
+            for v in C:
+                component[v] = c
+        return components, component
+
+    def _covers(self):
+        '''
+        Return (components, component, up, down, reach) where up[c], 
+        down[c] and reach[c] are the bitsets of the components covering 
+        component c, of those it covers, and of all those reachable from 
+        it.  For a partial order every component is a single element.
+
+        Components come sinks first, so among the strict successors of 
+        a component the highest numbered one is covered by it.  Taking 
+        successors highest first and discarding everything they reach 
+        leaves exactly the covered ones.  Built once and dropped when 
+        the relation changes.
+
+        '''
+        hasse = getattr(self, '_hasse', None)
+        if hasse is None:
+            nodes, out, position = self._graph()
+            components, component = self._condensed()
+            reach, up = [], []
+            for c, C in enumerate(components):
+                r = 0
+                for v in C:
+                    for w in out[v]:
+                        d = component[w]
+                        if d != c:
+                            r |= reach[d] | 1 << d
+                rest, below = r, 0
+                while rest:
+                    d = rest.bit_length() - 1
+                    below |= reach[d]
+                    rest &= ~below & ~(1 << d)
+                reach.append(r)
+                up.append(r & ~below)
+            down = [0] * len(components)
+            for c, m in enumerate(up):
+                for d in _bits(m):
+                    down[d] |= 1 << c
+            hasse = self._hasse = (components, component, up, down, reach)
+        return hasse
+
+    def covers(self, x):
+        '''Return the elements that x covers: {y: y < x, nothing between}.'''
+        return self._covering(x, 3)
+
+    def covered_by(self, x):
+        '''Return the elements covering x: {y: x < y, nothing between}.'''
+        return self._covering(x, 2)
+
+    def _covering(self, x, which):
+        nodes, out, position = self._graph()
+        v = position.get(_key(x))
+        if v is None:
+            return Set()
+        hasse = self._covers()
+        components, component = hasse[:2]
+        return Set([nodes[w] for d in _bits(hasse[which][component[v]])
+                              for w in components[d]], reduce=False)
+
+    @property
+    def transitive_reduction(self):
+        '''
+        Return the covering pairs (x, y), with y covering x: the 
+        Hasse diagram of a partial order.
+
+        '''
+        nodes = self._graph()[0]
+        components, component, up, down, reach = self._covers()
+        return Relation._trusted([(nodes[v], nodes[w]) 
+                                  for c, C in enumerate(components)
+                                  for d in _bits(up[c])
+                                  for v in C
+                                  for w in components[d]], reduce=False)
+
     def element(self, x):
-        for e in self.elements:
-            if x == e: return e
+        self.elements
+        return self._elements.get(_key(x))
 
     @property
     def elements(self):
         if hasattr(self, 'elems'):
             return self.elems
         else:
-            self.elems = Set(OrderedElement(x, self) 
-                                for x in self.domain | self.range)
+            objs = self._adjacent()[2]
+            self._elements = dict((k, OrderedElement(x, self)) 
+                                  for k, x in objs.items())
+            self.elems = Set(self._elements.values(), reduce=False)
             return self.elems
 
     @property
     def domain(self):
-        return Set(x for x, y in self)
+        succ, pred, objs = self._adjacent()
+        return Set([objs[k] for k in succ], reduce=False)
 
     @property
     def range(self):
-        return Set(y for x, y in self)
+        succ, pred, objs = self._adjacent()
+        return Set([objs[k] for k in pred], reduce=False)
 
     @property
     def inverse(self):
-        return Relation([(y, x) for x, y in self])
+        return Relation._trusted([(y, x) for x, y in self], 
+                                 reduce=not self._sorted())
+
+    def compose(self, S):
+        '''
+        Return R o S = {(x, z): x S y and y R z for some y}, the 
+        relation applying S first and then R, by a hash join of the 
+        pairs of S against the adjacency index of R.
+
+        '''
+        succ = self._adjacent()[0]
+        return Relation._trusted([(x, z) for x, y in S 
+                                         for z in succ.get(_key(y), ())])
+
+    def image(self, X):
+        '''Return R[X] = {y: x R y for some x in X}.'''
+        succ = self._adjacent()[0]
+        return Set(y for x in X for y in succ.get(_key(x), ()))
+
+    def preimage(self, Y):
+        '''Return {x: x R y for some y in Y}.'''
+        pred = self._adjacent()[1]
+        return Set(x for y in Y for x in pred.get(_key(y), ()))
+
+    def restrict(self, X):
+        '''Return {(x, y) in R: x in X}.'''
+        succ = self._adjacent()[0]
+        return Relation._trusted([(x, y) for x in Set(X) 
+                                         for y in succ.get(_key(x), ())])
+
+    def corestrict(self, Y):
+        '''Return {(x, y) in R: y in Y}.'''
+        pred = self._adjacent()[1]
+        return Relation._trusted([(x, y) for y in Set(Y) 
+                                         for x in pred.get(_key(y), ())])
+
+    def _extremal(self):
+        '''
+        Return (first, last, maximals, minimals), found together by 
+        counting the loops and the strict out- and in-degree of every 
+        element in a single pass over the pairs: the first element 
+        is related to itself and to all n - 1 others, a maximal one 
+        is related to no other.  Of several candidates (in a 
+        relation that is not antisymmetric) the least is taken.
+
+        '''
+        extremal = getattr(self, '_extremes', None)
+        if extremal is None:
+            succ, pred, objs = self._adjacent()
+            out, into, loops = dict.fromkeys(objs, 0), dict.fromkeys(objs, 0), set()
+            if self._sorted():
+                keyed = iter(self)
+            else:
+                keyed = ((_key(x), _key(y)) for x, y in self)
+            for kx, ky in keyed:
+                if kx == ky:
+                    loops.add(kx)
+                else:
+                    out[kx] += 1
+                    into[ky] += 1
+            n = len(objs) - 1
+            first = Set([objs[k] for k in loops if out[k] == n], reduce=False)
+            last = Set([objs[k] for k in loops if into[k] == n], reduce=False)
+            extremal = self._extremes = (
+                self.element(first[0]) if first else None,
+                self.element(last[0]) if last else None,
+                Set([objs[k] for k in pred if not out[k]], reduce=False),
+                Set([objs[k] for k in succ if not into[k]], reduce=False))
+        return extremal
 
     @property
     def first(self): 
-        E = self.elements
-        for e in E:
-            if all(e <= x for x in E):
-                return e
+        return self._extremal()[0]
 
     @property
     def last(self): 
-        E = self.elements
-        for e in E:
-            if all(x <= e for x in E):
-                return e
+        return self._extremal()[1]
 
     @property
     def maximals(self): 
-        return Set([x for x in self.range if not self.successors(x, strict=True)])
+        return Set(self._extremal()[2], reduce=False)
 
     @property
     def minimals(self): 
-        return Set([x for x in self.domain if not self.predecessors(x, strict=True)])
+        return Set(self._extremal()[3], reduce=False)
 
     def predecessors(self, c, strict=False):
         '''Return {x: x R c}.'''
-        return Set(m for m, n in self if n == c 
-                                      and (True if not strict else m != n))
+        P = self._adjacent()[1].get(_key(c), ())
+        return Set(m for m in P if not strict or m != c)
 
     def successors(self, c, strict=False):
         '''Return {x: c R x}.'''
-        return Set(n for m, n in self if m == c 
-                                      and (True if not strict else m != n))
+        S = self._adjacent()[0].get(_key(c), ())
+        return Set(n for n in S if not strict or c != n)
 
     def __rdiv__(self, i):
         return self.equivalence_class(i)
@@ -368,40 +1579,139 @@ class Relation(Set):
     def equivalence_class(self, i):
         # return self.domain
         # return i, self.domain, i == self.domain
-        if i == self.domain:
+        if isinstance(i, list) and i == self.domain:
             return self.equivalence_classes
         else:
-            return Set(y for x, y in self if x == i)
+            return self.successors(i)
 
     @property
     def equivalence_classes(self):
-        return Set(x/self for x in self.domain)
+        '''
+        Return the classes of the equivalence relation generated by 
+        this one (its own classes, if it is one) as a Partition, 
+        found by union-find over the pairs, whose elements are 
+        numbered through a single dict of their keys.
+
+        '''
+        if not self:
+            return Partition._trusted([])
+        elems = [x for x, y in self] + [y for x, y in self]
+        ordered = _SCALAR_TYPES.issuperset(map(type, elems))
+        if ordered:
+            keys = elems
+            nodes = sorted(set(elems))
+            ids = dict(_zip(nodes, count()))
+        else:
+            keys = list(map(_key, elems))
+            first = dict(_zip(reversed(keys), reversed(elems)))
+            nodes = list(first.values())
+            ids = dict(_zip(first, count()))
+        index = list(map(ids.__getitem__, keys))
+        m = len(self)
+        roots = _union_find(len(nodes), _zip(index[:m], index[m:]))
+        # Group the elements by root with a stable sort, keeping each 
+        # block in element order, and cut where the root changes.
+        order = sorted(range(len(nodes)), key=roots.__getitem__)
+        members = list(map(nodes.__getitem__, order))
+        roots = list(map(roots.__getitem__, order))
+        cuts = [bisect_right(roots, r) for r in sorted(set(roots))]
+        blocks = []
+        for i, j in _zip([0] + cuts, cuts):
+            B = FrozenSet(members[i:j], reduce=False)
+            B._ordered = ordered or None
+            blocks.append(B)
+        return Partition._trusted(blocks)
 
     @property
     def comparable(self):
-        X = [x for x in self.domain | self.range]
+        M = self._matrix()
+        if M is not None:
+            return bool((M | M.T).all())
+        X = self._graph()[0]
+        if self._size() < len(X) * (len(X) + 1) // 2:
+            return False
         return all((a, b) in self or (b, a) in self for a in X for b in X)
 
     @property
     def reflexive(self):
+        M = self._matrix()
+        if M is not None:
+            return bool(M.diagonal().all())
         return all((m, m) in self and (n, n) in self for (m, n) in self)
 
     @property
     def symmetric(self):
+        M = self._matrix()
+        if M is not None:
+            return bool((M == M.T).all())
         return all((n, m) in self for (m, n) in self)
 
     @property
     def antisymmetric(self):
+        M = self._matrix()
+        if M is not None:
+            S = M & M.T
+            return not S.any() or bool((S == numpy.diag(S.diagonal())).all())
         return all((n, m) not in self for (m, n) in self if n != m)
 
     @property
     def transitive(self):
+        M = self._matrix()
+        if M is not None:
+            F = M.astype(numpy.float32)
+            return not (F.dot(F) > 0)[~M].any()
+        succ = self._adjacent()[0]
         for (x, y) in self:
-            for (y_, z) in self:
-                if y == y_ and not (x, z) in self: 
+            for z in succ.get(_key(y), ()):
+                if not (x, z) in self: 
                     return False
         return True
 
+    @property
+    def transitive_closure(self):
+        '''
+        Return the smallest transitive relation containing this one.
+
+        The strongly connected components are condensed, and the 
+        elements reachable from each component are collected as a 
+        bitset, sinks first, by or-ing those of its successors.
+
+        '''
+        nodes, out, position = self._graph()
+        components, component = self._condensed()
+        reach, members = [], []
+        for c, C in enumerate(components):
+            mask, cyclic = 0, len(C) > 1
+            for v in C:
+                for w in out[v]:
+                    d = component[w]
+                    if d == c:
+                        cyclic = True
+                    else:
+                        mask |= reach[d] | members[d]
+            inside = sum(1 << v for v in C)
+            reach.append(mask | inside if cyclic else mask)
+            members.append(inside)
+        return Relation._trusted([(x, nodes[w]) 
+                                  for v, x in enumerate(nodes)
+                                  for w in _bits(reach[component[v]])], 
+                                 reduce=False)
+
+    @property
+    def reflexive_closure(self):
+        '''Return the smallest reflexive relation containing this one.'''
+        return Relation._trusted(list(self) + [(x, x) for x in self._graph()[0]])
+
+    @property
+    def symmetric_closure(self):
+        '''Return the smallest symmetric relation containing this one.'''
+        return Relation._trusted(list(self) + [(y, x) for x, y in self])
+
+    @property
+    def equivalence_closure(self):
+        '''Return the smallest equivalence relation containing this one.'''
+        return self.symmetric_closure.transitive_closure.reflexive_closure
+
     @property
     def partial_order(self):
         return self.reflexive and self.transitive and self.antisymmetric
@@ -411,43 +1721,1257 @@ class Relation(Set):
         return self.partial_order and self.comparable
 
 
-class Partition(Set):
+class Poset(Relation):
     '''
-    Representation of a partition on a set.
-    
+    Representation of a partially ordered set by the relation holding 
+    its order.
+
+    On first use a Poset compiles the reflexive, transitive order 
+    generated by its pairs: each element gets a topological number 
+    and the bitsets of the elements strictly above and below it.  
+    Comparisons are then a number check and a bit test, and interval, 
+    up-set and down-set queries cost time proportional to their 
+    output rather than to the size of the relation.
+
+    Predecessors, successors, `partial_order` and `total_order` are 
+    those of the compiled order too, so they agree with `le` and `lt`; 
+    the other properties (`reflexive`, `transitive`, ...) describe the 
+    pairs as given.
+
     '''
-    def __init__(self, seq, **kwargs):
-        for S in seq:
-            assert type(S) is Set
-        super(Partition, self).__init__(seq, **kwargs)
+    def _changed(self):
+        super(Poset, self)._changed()
+        self._order = None
+
+    def _compiled(self):
+        '''
+        Return (components, component, position, above, below): the 
+        strongly connected components of `_graph`, sinks first, the 
+        component of each element, the position of each element by 
+        key, and for each component the bitsets of the components 
+        strictly above and below it.  The component numbers are the 
+        reverse of a topological order.
+
+        '''
+        order = getattr(self, '_order', None)
+        if order is None:
+            nodes, out, position = self._graph()
+            components, component, up, down, above = self._covers()
+            below = [0] * len(components)
+            for c in reversed(range(len(components))):
+                for d in _bits(down[c]):
+                    below[c] |= below[d] | 1 << d
+            order = self._order = (components, component, position, 
+                                   above, below)
+        return order
+
+    def _component(self, x):
+        components, component, position = self._compiled()[:3]
+        v = position.get(_key(x))
+        return None if v is None else component[v]
+
+    def _members(self, mask):
+        nodes, components = self._graph()[0], self._compiled()[0]
+        return Set([nodes[v] for c in _bits(mask) for v in components[c]], 
+                   reduce=False)
+
+    def le(self, x, y):
+        '''Return True if x <= y.'''
+        cx, cy = self._component(x), self._component(y)
+        if cx is None or cy is None or cx < cy:
+            return False
+        return cx == cy or bool(self._compiled()[3][cx] >> cy & 1)
+
+    def lt(self, x, y):
+        '''Return True if x < y.'''
+        return x != y and self.le(x, y)
+
+    def _bound(self, masks):
+        '''
+        Return an element whose component has every other component 
+        in its bitset among masks, or None if there is none.
+
+        '''
+        components, component, position, above, below = self._compiled()
+        full = (1 << len(components)) - 1
+        for c, mask in enumerate(masks):
+            if mask | 1 << c == full:
+                return self.element(self._graph()[0][components[c][0]])
 
     @property
-    def equivalence_relation(self):
-        R = Relation([])
-        for S in self:
-            R.extend(S * S)
-        return R
+    def first(self):
+        return self._bound(self._compiled()[3])
 
-    def __rdiv__(self, S):
-        if self.union(*self) == S:
-            return self.equivalence_relation
+    @property
+    def last(self):
+        return self._bound(self._compiled()[4])
+
+    def upset(self, x, strict=False):
+        '''Return {y: x <= y}, or {y: x < y} if strict.'''
+        c = self._component(x)
+        if c is None:
+            return Set()
+        mask = self._compiled()[3][c]
+        return self._members(mask if strict else mask | 1 << c)
+
+    def downset(self, x, strict=False):
+        '''Return {y: y <= x}, or {y: y < x} if strict.'''
+        c = self._component(x)
+        if c is None:
+            return Set()
+        mask = self._compiled()[4][c]
+        return self._members(mask if strict else mask | 1 << c)
+
+    def between(self, x, y, strict=False):
+        '''Return {z: x <= z <= y}, or {z: x < z < y} if strict.'''
+        cx, cy = self._component(x), self._component(y)
+        if cx is None or cy is None or not self.le(x, y):
+            return Set()
+        components, component, position, above, below = self._compiled()
+        mask = above[cx] & below[cy]
+        return self._members(mask if strict else mask | 1 << cx | 1 << cy)
 
+    def predecessors(self, c, strict=False):
+        '''Return {x: x <= c}, or {x: x < c} if strict.'''
+        P = self.downset(c)
+        if strict:
+            P.discard(c)
+        return P
 
-class SampleSpace(object):
-    '''
-    Representation of a sample space.
+    def successors(self, c, strict=False):
+        '''Return {x: c <= x}, or {x: c < x} if strict.'''
+        S = self.upset(c)
+        if strict:
+            S.discard(c)
+        return S
 
-    '''
-    def __init__(self, *sets):
-        U = Set()
-        self.space = U.union(*sets)
-        self.size = float(len(self.space))
+    @property
+    def partial_order(self):
+        '''
+        Return True if the compiled order is antisymmetric, which makes 
+        it a partial order: no two elements are each below the other.
+
+        '''
+        return all(len(C) == 1 for C in self._compiled()[0])
+
+    @property
+    def total_order(self):
+        components, component, position, above, below = self._compiled()
+        full = (1 << len(components)) - 1
+        return self.partial_order and all(
+            above[c] | below[c] | 1 << c == full 
+            for c in range(len(components)))
+
+
+class Partition(Set):
+    '''
+    Representation of a partition on a set.
+
+    The blocks are held as FrozenSets.
+    
+    '''
+    def __init__(self, seq, **kwargs):
+        blocks = []
+        for S in seq:
+            assert isinstance(S, Set)
+            blocks.append(S if isinstance(S, FrozenSet) else FrozenSet(S))
+        super(Partition, self).__init__(blocks, **kwargs)
+
+    @classmethod
+    def _trusted(cls, blocks):
+        '''
+        Return the partition into blocks known to be disjoint, 
+        nonempty FrozenSets, each already sorted, ordering the blocks 
+        by their least members without checking them again.
+
+        '''
+        P = cls.__new__(cls)
+        list.__init__(P, sorted(blocks, key=lambda B: B[0]))
+        P._index = P._ordered = P._labels = None
+        return P
+
+    def _changed(self):
+        super(Partition, self)._changed()
+        self._labels = None
+
+    @property
+    def labels(self):
+        '''
+        Return a dict mapping the key of each element (see `_key`) to 
+        the position of its block.
+
+        '''
+        labels = getattr(self, '_labels', None)
+        if labels is None:
+            labels = {}
+            for i, S in enumerate(self):
+                for k in S._frozenkey():
+                    labels[k] = i
+            self._labels = labels
+        return labels
+
+    def block(self, x):
+        '''Return the block containing x, or None.'''
+        i = self.labels.get(_key(x))
+        return None if i is None else self[i]
+
+    @property
+    def equivalence_relation(self):
+        return EquivalenceRelation(self)
+
+    def __rdiv__(self, S):
+        labels = self.labels
+        if not isinstance(S, Set):
+            S = Set(S)
+        if S._size() == len(labels) and all(_key(x) in labels for x in S):
+            return self.equivalence_relation
+
+
+class _View(object):
+    '''
+    Base of the collections that are represented without building 
+    their members.  Subclasses provide `len`, iteration and 
+    membership, and may override `_same` to compare two views of 
+    their own kind without reading members.
+
+    '''
+    def _size(self):
+        return len(self)
+
+    def _same(self, X):
+        '''Return whether X, of the same kind, is equal, or None.'''
+        return None
+
+    def __eq__(self, X):
+        if isinstance(X, type(self)):
+            same = self._same(X)
+            if same is not None:
+                return same
+        try:
+            X = Set(X)
+        except TypeError:
+            return False
+        return len(X) == self._size() and all(x in self for x in X)
+
+    def __ne__(self, X):
+        return not self.__eq__(X)
+
+    @property
+    def relation(self):
+        '''Return the pairs as a Relation.'''
+        return Relation._trusted(list(self), reduce=False)
+
+
+class EquivalenceRelation(_View):
+    '''
+    Representation of the equivalence relation of a Partition, 
+    without building its pairs.
+
+    Membership compares the block labels of the two components, 
+    `len` is the sum of the squared block sizes, and the pairs are 
+    generated block by block on demand.  `relation` builds the real 
+    Relation when one is needed.
+
+    '''
+    def __init__(self, partition):
+        self.partition = partition
+
+    def __contains__(self, t):
+        if not (isinstance(t, tuple) and len(t) == 2):
+            return False
+        labels = self.partition.labels
+        try:
+            i = labels.get(_key(t[0]))
+            return i is not None and i == labels.get(_key(t[1]))
+        except TypeError:
+            return False
+
+    def __len__(self):
+        return sum(len(S) ** 2 for S in self.partition)
+
+    def __iter__(self):
+        for S in self.partition:
+            for a in S:
+                for b in S:
+                    yield (a, b)
+
+    def _same(self, X):
+        return self.partition == X.partition
+
+    def __repr__(self):
+        return "EquivalenceRelation({0})".format(self.partition)
+
+    def __rdiv__(self, i):
+        return self.equivalence_class(i)
+
+    def equivalence_class(self, i):
+        if isinstance(i, list) and i == self.domain:
+            return self.equivalence_classes
+        else:
+            return self.successors(i)
+
+    @property
+    def equivalence_classes(self):
+        return self.partition
+
+    def successors(self, c, strict=False):
+        '''Return {x: c R x}.'''
+        S = self.partition.block(c)
+        if S is None:
+            return Set()
+        return Set(x for x in S if not strict or x != c)
+
+    predecessors = successors
+
+    @property
+    def domain(self):
+        return Set().union(*self.partition)
+
+    range = domain
+
+    @property
+    def inverse(self):
+        return self
+
+    reflexive = symmetric = transitive = True
+
+    @property
+    def antisymmetric(self):
+        return all(len(S) == 1 for S in self.partition)
+
+    partial_order = antisymmetric
+
+    @property
+    def comparable(self):
+        return len(self.partition) <= 1
+
+    @property
+    def total_order(self):
+        return self.antisymmetric and self.comparable
+
+
+class CompactRelation(_View):
+    '''
+    Representation of a large binary relation as two integer columns.
+
+    Each element is interned to its position in `members`, and the 
+    pairs are held sorted and without duplicates in the columns 
+    `left` and `right`: NumPy int64 arrays when NumPy is available, 
+    64-bit arrays from the array module otherwise.  A pair then costs 16 bytes instead of a 
+    tuple of two references.  Membership and successors are binary 
+    searches in the columns; `relation` builds the real Relation 
+    when one is needed.
+
+    '''
+    def __init__(self, seq=()):
+        ids, members = {}, []
+        left, right = array(_ID), array(_ID)
+        for x, y in seq:
+            for v, column in ((x, left), (y, right)):
+                k = _key(v)
+                i = ids.get(k)
+                if i is None:
+                    i = ids[k] = len(members)
+                    members.append(v)
+                column.append(i)
+        self._load(members, left, right)
+
+    @classmethod
+    def from_arrays(cls, left, right, members=None):
+        '''
+        Return the relation pairing left[i] with right[i].  Given the 
+        intern table members, left and right hold positions in it; 
+        otherwise they hold the elements themselves.
+
+        '''
+        R = cls.__new__(cls)
+        if members is not None:
+            R._load(list(members), left, right)
+        elif numpy is not None:
+            m = len(left)
+            values = numpy.concatenate([numpy.asarray(left), numpy.asarray(right)])
+            if values.dtype.kind in 'iu' and m:
+                # Small integer ranges are interned through a lookup 
+                # table rather than sorting all 2m values.
+                low, high = values.min(), values.max()
+                if high - low < 4 * len(values):
+                    seen = numpy.zeros(high - low + 1, bool)
+                    seen[values - low] = True
+                    members = numpy.flatnonzero(seen)
+                    table = numpy.cumsum(seen) - 1
+                    ids = table[values - low]
+                    R._load((members + low).tolist(), ids[:m], ids[m:], 
+                            ordered=True)
+                    return R
+            members, ids = numpy.unique(values, return_inverse=True)
+            R._load(members.tolist(), ids[:m], ids[m:], ordered=True)
+        else:
+            R.__init__(_zip(left, right))
+        return R
+
+    @classmethod
+    def from_csv(cls, f, delimiter=',', convert=None):
+        '''
+        Return the relation read from an edge list with one pair per 
+        row, the first two fields of each row, from the file or path 
+        f.  Use delimiter='\t' for TSV.  Fields are strings unless a 
+        function convert is given to apply to each of them.  The two 
+        columns are read whole and, when they hold scalars, interned 
+        together by `from_arrays`.
+
+        '''
+        if not hasattr(f, 'read'):
+            with open(f) as f:
+                return cls.from_csv(f, delimiter, convert)
+        rows = [row for row in csv.reader(f, delimiter=delimiter) if row]
+        left = list(map(itemgetter(0), rows))
+        right = list(map(itemgetter(1), rows))
+        del rows
+        if convert is not None:
+            left, right = list(map(convert, left)), list(map(convert, right))
+        if _SCALAR_TYPES.issuperset(map(type, chain(left, right))):
+            return cls.from_arrays(left, right)
+        return cls(_zip(left, right))
+
+    def _load(self, members, left, right, ordered=False):
+        '''
+        Set the columns from positions left and right in members, 
+        numbering the members in sorted order when they are scalars 
+        (unless they are known to be sorted scalars already), then 
+        sorting the pairs and removing duplicates.  Sorted members are 
+        found by binary search, others through `position`.
+
+        '''
+        n = len(members)
+        order = None
+        if not ordered and all(map(_scalar, members)):
+            try:
+                order = sorted(range(n), key=members.__getitem__)
+            except TypeError:
+                pass
+        if numpy is not None:
+            left = numpy.asarray(left, numpy.int64)
+            right = numpy.asarray(right, numpy.int64)
+            if order is not None:
+                rank = numpy.empty(n, numpy.int64)
+                rank[order] = numpy.arange(n)
+                left, right = rank[left], rank[right]
+            codes = numpy.unique(left * n + right)
+            self.left, self.right = codes // max(n, 1), codes % max(n, 1)
+        else:
+            if order is not None:
+                rank = array(_ID, [0]) * n
+                for j, i in enumerate(order):
+                    rank[i] = j
+                left = [rank[i] for i in left]
+                right = [rank[i] for i in right]
+            codes = sorted(set(l * n + r for l, r in _zip(left, right)))
+            self.left = array(_ID, [c // n for c in codes])
+            self.right = array(_ID, [c % n for c in codes])
+        if order is not None:
+            members = [members[i] for i in order]
+        self.members = members
+        self._sorted = ordered or order is not None
+        self._position = None
+        self._inverse = None
+
+    @property
+    def position(self):
+        '''Return a dict from the key of each member to its id.'''
+        if self._position is None:
+            self._position = dict((_key(x), i) for i, x in enumerate(self.members))
+        return self._position
+
+    def _block(self, i):
+        '''Return the slice of the columns whose pairs start at id i.'''
+        return bisect_left(self.left, i), bisect_right(self.left, i)
+
+    def _id(self, x):
+        try:
+            if self._sorted:
+                members = self.members
+                i = bisect_left(members, x)
+                return i if i < len(members) and members[i] == x else None
+            return self.position.get(_key(x))
+        except TypeError:
+            return None
+
+    def __len__(self):
+        return len(self.left)
+
+    def __iter__(self):
+        members = self.members
+        for i, j in _zip(self.left, self.right):
+            yield (members[i], members[j])
+
+    def __contains__(self, t):
+        if not (isinstance(t, tuple) and len(t) == 2):
+            return False
+        i, j = self._id(t[0]), self._id(t[1])
+        if i is None or j is None:
+            return False
+        lo, hi = self._block(i)
+        k = bisect_left(self.right, j, lo, hi)
+        return k < hi and self.right[k] == j
+
+    def __repr__(self):
+        return "CompactRelation({0} pairs over {1} elements)".format(
+                len(self), len(self.members))
+
+    def _members(self, ids):
+        members = self.members
+        return Set([members[i] for i in ids], reduce=False)
+
+    def successors(self, c, strict=False):
+        '''Return {x: c R x}.'''
+        i = self._id(c)
+        if i is None:
+            return Set()
+        lo, hi = self._block(i)
+        return self._members(j for j in self.right[lo:hi] if not strict or j != i)
+
+    def predecessors(self, c, strict=False):
+        '''Return {x: x R c}.'''
+        return self.inverse.successors(c, strict)
+
+    @property
+    def domain(self):
+        if numpy is not None:
+            return self._members(numpy.unique(self.left))
+        return self._members(sorted(set(self.left)))
+
+    @property
+    def range(self):
+        return self.inverse.domain
+
+    @property
+    def inverse(self):
+        if self._inverse is None:
+            R = CompactRelation.__new__(CompactRelation)
+            R._load(self.members, self.right, self.left, ordered=self._sorted)
+            R._position = self._position
+            R._inverse = self
+            self._inverse = R
+        return self._inverse
+
+
+class Ground(object):
+    '''
+    Representation of a fixed, finite ground set whose members are 
+    interned to bit positions, so that its subsets can be held as 
+    BitSets.
+
+    '''
+    def __init__(self, seq):
+        S = Set(seq)
+        self.members = list(S)
+        self.ordered = S._sorted()
+        self.position = dict((_key(x), i) for i, x in enumerate(self.members))
+        self.full = (1 << len(self.members)) - 1
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, x):
+        return _key(x) in self.position
+
+    def __repr__(self):
+        return "Ground({0})".format(self.members)
+
+    def mask(self, seq):
+        '''
+        Return the int whose set bits are the positions of the 
+        members of seq.  Raise KeyError if one of them is not in 
+        the ground set.
+
+        '''
+        if isinstance(seq, BitSet) and seq.ground is self:
+            return seq.mask
+        # Or-ing the bits into an int one at a time copies it each 
+        # time; set them in a little-endian bitmap and convert once.
+        bits = bytearray((len(self.members) + 7) // 8)
+        position = self.position
+        for x in seq:
+            i = position[_key(x)]
+            bits[i >> 3] |= 1 << (i & 7)
+        if not bits:
+            return 0
+        bits.reverse()
+        return int(hexlify(bytes(bits)), 16)
+
+    def subset(self, seq):
+        '''Return the subset of members in seq as a BitSet.'''
+        return BitSet(self, self.mask(seq))
+
+
+class BitSet(object):
+    '''
+    Representation of a subset of a Ground as an int bitmask.
+
+    Boolean operations, containment tests and `len` are each a 
+    single big-int operation.  The other operand may be any 
+    collection; members of it outside the ground set are ignored 
+    by intersection, difference and the containment tests, while 
+    union, symmetric difference and X - B raise KeyError, since 
+    their result would not be a subset of the ground set.
+
+    '''
+    def __init__(self, ground, mask=0):
+        self.ground = ground
+        self.mask = mask
+        self._hash = None
+
+    def _mask(self, X):
+        '''Return the mask of X, reading its members if need be.'''
+        return self.ground.mask(X)
+
+    def _part(self, X):
+        '''
+        Return (mask, outside): the mask of the members of X in the 
+        ground set and the number of members of X outside it.
+
+        '''
+        if isinstance(X, BitSet) and X.ground is self.ground:
+            return X.mask, 0
+        position = self.ground.position
+        keys = set(_key(x) for x in X)
+        inside = [k for k in keys if k in position]
+        return self.ground.mask(inside), len(keys) - len(inside)
+
+    def __len__(self):
+        return _popcount(self.mask)
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    __bool__ = __nonzero__
+
+    def __iter__(self):
+        members = self.ground.members
+        for i in _bits(self.mask):
+            yield members[i]
+
+    def __contains__(self, x):
+        i = self.ground.position.get(_key(x))
+        return i is not None and bool(self.mask >> i & 1)
+
+    def __repr__(self):
+        return "BitSet({0})".format(list(self))
+
+    def __hash__(self):
+        # Hash as the key of the same members held in a list (see 
+        # `_key`), so that BitSets and Sets find each other.
+        if self._hash is None:
+            self._hash = hash(frozenset(_key(x) for x in self))
+        return self._hash
+
+    def __eq__(self, X):
+        if isinstance(X, BitSet) and X.ground is not self.ground:
+            return (len(self) == len(X) and 
+                    set(_key(x) for x in self) == set(_key(x) for x in X))
+        try:
+            return self.mask == self._mask(X)
+        except (KeyError, TypeError):
+            return False
+
+    def __ne__(self, X):
+        return not self.__eq__(X)
+
+    def __and__(self, X):
+        return BitSet(self.ground, self.mask & self._part(X)[0])
+
+    def __or__(self, X):
+        return BitSet(self.ground, self.mask | self._mask(X))
+
+    def __sub__(self, X):
+        return BitSet(self.ground, self.mask & ~self._part(X)[0])
+
+    def __xor__(self, X):
+        return BitSet(self.ground, self.mask ^ self._mask(X))
+
+    __rand__, __ror__, __rxor__ = __and__, __or__, __xor__
+
+    def __rsub__(self, X):
+        return BitSet(self.ground, self._mask(X) & ~self.mask)
+
+    def __invert__(self):
+        return BitSet(self.ground, self.ground.full & ~self.mask)
+
+    def __le__(self, X):
+        return self.issubset(X)
+
+    def __lt__(self, X):
+        return self.issubset(X, proper=True)
+
+    def __ge__(self, X):
+        return self.issuperset(X)
+
+    def __gt__(self, X):
+        return self.issuperset(X, proper=True)
+
+    def issubset(self, X, proper=False):
+        m, outside = self._part(X)
+        return (self.mask & ~m == 0 and 
+                not (proper and self.mask == m and not outside))
+
+    def issuperset(self, X, proper=False):
+        m, outside = self._part(X)
+        return (not outside and m & ~self.mask == 0 and 
+                not (proper and self.mask == m))
+
+    def isdisjoint(self, X):
+        return self.mask & self._part(X)[0] == 0
+
+    @property
+    def set(self):
+        '''Return the members as a Set.'''
+        return _from_sorted(list(self)) if self.ground.ordered else Set(self)
+
+
+class CartesianProduct(_View):
+    '''
+    Representation of the cartesian product of finite sets, without 
+    building it.
+
+    The tuples are generated in lexicographic order, which is the 
+    order of the corresponding Relation.  Membership checks each 
+    component against its set, and `relation` builds the real 
+    Relation of a binary product when one is needed.
+
+    '''
+    def __init__(self, *sets):
+        self.sets = [S if isinstance(S, Set) else Set(S) for S in sets]
+        self.size = 1
+        for S in self.sets:
+            self.size *= len(S)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return _product(*self.sets)
+
+    def __contains__(self, t):
+        return (isinstance(t, tuple) and len(t) == len(self.sets) and 
+                all(x in S for x, S in zip(t, self.sets)))
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('CartesianProduct index out of range')
+        t = []
+        for S in reversed(self.sets):
+            i, j = divmod(i, len(S))
+            t.append(S[j])
+        return tuple(reversed(t))
+
+    def _size(self):
+        return self.size
+
+    def _same(self, X):
+        # Products with an empty factor are all the empty set.
+        if self.size != X.size:
+            return False
+        return not self.size or (
+            len(self.sets) == len(X.sets) and 
+            all(S == T for S, T in zip(self.sets, X.sets)))
+
+    def __repr__(self):
+        return " * ".join(repr(S) for S in self.sets)
+
+    def __rdiv__(self, i):
+        '''
+        Return the class of i under the binary product A * B read as 
+        a relation, which is B for i in A and empty otherwise; the 
+        domain A itself gives the equivalence classes.
+
+        '''
+        if len(self.sets) != 2:
+            return self.relation.__rdiv__(i)
+        A, B = self.sets
+        if not B:
+            return Set()
+        if isinstance(i, list) and i == A:
+            return self.relation.equivalence_classes
+        return _copy(B) if i in A else Set()
+
+    @property
+    def relation(self):
+        '''Return the tuples of a binary product as a Relation.'''
+        if len(self.sets) != 2:
+            raise ValueError('only a binary product is a relation')
+        return super(CartesianProduct, self).relation
+
+
+class PowerSet(_View):
+    '''
+    Representation of the power set of a finite set, without 
+    building it.
+
+    The subsets are BitSets over a Ground on the base set, and the 
+    subset whose mask is i has rank i.  Iteration runs in that 
+    (binary counting) order, or in Gray-code order through `gray`, 
+    and costs O(1) amortized big-int work per subset.  Note that 
+    `len` is limited to sys.maxsize; `size` is not.
+
+    '''
+    def __init__(self, seq):
+        self.ground = Ground(seq)
+        self.size = 1 << len(self.ground)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        ground, i = self.ground, 0
+        while i < self.size:
+            yield BitSet(ground, i)
+            i += 1
+
+    def __contains__(self, X):
+        try:
+            return all(x in self.ground for x in X)
+        except TypeError:
+            return False
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('PowerSet index out of range')
+        return self.unrank(i)
+
+    def _size(self):
+        return self.size
+
+    def _same(self, X):
+        return self.ground.members == X.ground.members
+
+    def __repr__(self):
+        return "PowerSet({0})".format(self.ground.members)
+
+    def gray(self):
+        '''
+        Generate the subsets in Gray-code order, each differing from 
+        the one before by a single member.
+
+        '''
+        ground, g, i = self.ground, 0, 0
+        yield BitSet(ground, g)
+        while i < self.size - 1:
+            i += 1
+            g ^= i & -i
+            yield BitSet(ground, g)
+
+    def rank(self, X, gray=False):
+        '''Return the position of the subset X in the iteration order.'''
+        m = self.ground.mask(X)
+        if gray:
+            r = m
+            while m:
+                m >>= 1
+                r ^= m
+            return r
+        return m
+
+    def unrank(self, i, gray=False):
+        '''Return the subset at position i of the iteration order.'''
+        if gray:
+            i ^= i >> 1
+        return BitSet(self.ground, i)
+
+    @property
+    def set(self):
+        '''Return all of the subsets as a Set.'''
+        return Set(self, reduce=False)
+
+    def relation(self, cond):
+        return self.set.relation(cond)
+
+
+class SampleSpace(object):
+    '''
+    Representation of a sample space.
+
+    The outcomes are interned in a Ground, and events are read as 
+    BitSets over it, so intersecting two events is a single big-int 
+    operation.  Events may be BitSets from `event` or any collection 
+    of outcomes.
+
+    Events may also be predicates on outcomes.
+
+    Outcomes are equally likely unless a dict of weights is given, 
+    e.g. SampleSpace(A, B, weights={'a': 2, ...}).  The measure of 
+    each distinct event is computed once and cached: a popcount, or 
+    for weighted outcomes a product of the unpacked masks with the 
+    weight vector when NumPy is available.  `batch`, `conditional` 
+    and `joint` answer many queries at once, reading each event only 
+    once.
+
+    '''
+    def __init__(self, *sets, **kwargs):
+        U = Set()
+        self.space = U.union(*sets)
+        self.size = float(len(self.space))
+        self.ground = Ground(self.space)
+        weights = kwargs.get('weights')
+        if weights is None:
+            self.weights = None
+            self.total = self.size
+        else:
+            self.weights = [float(weights[x]) for x in self.ground.members]
+            self.total = sum(self.weights)
+            if numpy is not None:
+                self._vector = numpy.array(self.weights)
+        self._measures = OrderedDict()
 
     def __call__(self, set, given=[]):
         if given:
-            return len(set & given) / float(len(given))
+            return self.conditional([(set, given)])[0]
+        else:
+            return self.batch([set])[0]
+
+    def event(self, seq):
+        '''
+        Return the event consisting of the outcomes in seq, or the 
+        outcomes satisfying seq if it is a predicate.
+
+        '''
+        return BitSet(self.ground, self._masks([seq])[0])
+
+    def family(self, events=()):
+        '''Return an EventFamily of events, to which more can be added.'''
+        return EventFamily(self, events)
+
+    def sampled(self, **options):
+        '''
+        Return a SampledSpace drawing from the outcomes with their 
+        weights, to estimate probabilities rather than count them.
+
+        '''
+        return SampledSpace(self.ground.members, weights=self.weights, 
+                            **options)
+
+    def _masks(self, events):
+        '''Return the mask of each of events, reading each object once.'''
+        mask, seen = self.ground.mask, {}
+        masks = []
+        for A in events:
+            m = seen.get(id(A))
+            if m is None:
+                if callable(A):
+                    m = mask(x for x in self.ground.members if A(x))
+                else:
+                    m = mask(A)
+                seen[id(A)] = m
+            masks.append(m)
+        return masks
+
+    def _measure(self, masks):
+        '''Return the total weight of the outcomes in each of masks.'''
+        measures = self._measures
+        new = [m for m in set(masks) if m not in measures]
+        if self.weights is not None and numpy is not None and new:
+            n, w = len(self.weights), self._vector
+            totals = numpy.zeros(len(new))
+            for lo, M in _blocks(new, n, _width(len(new))):
+                totals += M.dot(w[lo:lo + M.shape[1]])
+            found = dict(zip(new, totals.tolist()))
+        else:
+            found = dict((m, self._weigh(m)) for m in new)
+        result = [measures[m] if m in measures else found[m] for m in masks]
+        for m in new:
+            measures[m] = found[m]
+        while len(measures) > _MEASURES:
+            measures.popitem(last=False)
+        return result
+
+    def _weigh(self, m):
+        '''Return the total weight of the outcomes in the mask m.'''
+        if self.weights is None:
+            return float(_popcount(m))
+        weights = self.weights
+        return sum(weights[i] for i in _bits(m))
+
+    def batch(self, events, given=None):
+        '''Return [P(A) for A in events], or P(A | given) for each.'''
+        masks = self._masks(events)
+        if given is None:
+            return [w / self.total for w in self._measure(masks)]
+        g = self._masks([given])[0]
+        total = self._measure([g])[0]
+        return [w / total for w in self._measure([m & g for m in masks])]
+
+    def conditional(self, pairs):
+        '''Return [P(A | B) for A, B in pairs].'''
+        pairs = list(pairs)
+        masks = self._masks([A for A, B in pairs] + [B for A, B in pairs])
+        k = len(pairs)
+        given = self._measure(masks[k:])
+        joint = self._measure([a & b for a, b in zip(masks[:k], masks[k:])])
+        return [w / g for w, g in zip(joint, given)]
+
+    def joint(self, pairs):
+        '''Return [P(A & B) for A, B in pairs].'''
+        pairs = list(pairs)
+        masks = self._masks([A for A, B in pairs] + [B for A, B in pairs])
+        k = len(pairs)
+        return [w / self.total for w in 
+                self._measure([a & b for a, b in zip(masks[:k], masks[k:])])]
+
+
+class EventFamily(object):
+    '''
+    Representation of a family of events A_1, ..., A_k of a 
+    SampleSpace, for all their pairwise probabilities at once.
+
+    The events are the columns of an outcome by event incidence 
+    matrix M, and the weights of all the pairwise intersections are 
+    the entries of the single product M^T W M, with W the diagonal 
+    of outcome weights.  With NumPy the product is accumulated over 
+    blocks of outcomes, so M is never built in full; without it 
+    each entry is a popcount of two masks.  Adding events only 
+    computes the new rows and columns of the product.
+
+    '''
+    def __init__(self, space, events=()):
+        self.space = space
+        self.masks = []
+        self._counts = numpy.zeros((0, 0)) if numpy is not None else []
+        self.add(*events)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def _product(self, X, Y):
+        '''Return the matrix of the weights of x & y for x in X, y in Y.'''
+        if numpy is None:
+            weigh = self.space._weigh
+            return [[weigh(x & y) for y in Y] for x in X]
+        n, w = len(self.space.ground), getattr(self.space, '_vector', None)
+        # Counts within a block are exact in single precision.
+        dtype = numpy.float32 if w is None else float
+        G = numpy.zeros((len(X), len(Y)))
+        width = _width(len(X) + len(Y))
+        if Y is X:
+            blocks = ((lo, A, None) for lo, A in _blocks(X, n, width))
+        else:
+            blocks = ((lo, A, B) for (lo, A), (_, B) in 
+                      _zip(_blocks(X, n, width), _blocks(Y, n, width)))
+        for lo, A, B in blocks:
+            A = A.astype(dtype)
+            B = A if B is None else B.astype(dtype)
+            if w is not None:
+                A = A * w[lo:lo + A.shape[1]]
+            G += A.dot(B.T)
+        return G
+
+    def add(self, *events):
+        '''Add events to the family.'''
+        old, new = self.masks, self.space._masks(events)
+        if not new:
+            return
+        cross, inner = self._product(old, new), self._product(new, new)
+        if numpy is None:
+            C = [row + extra for row, extra in zip(self._counts, cross)]
+            for j in range(len(new)):
+                C.append([row[j] for row in cross] + inner[j])
         else:
-            return len(set) / self.size
+            k = len(old)
+            C = numpy.empty((k + len(new), k + len(new)))
+            C[:k, :k] = self._counts
+            C[:k, k:] = cross
+            C[k:, :k] = cross.T
+            C[k:, k:] = inner
+        self._counts = C
+        self.masks = old + new
+
+    @property
+    def counts(self):
+        '''
+        Return the matrix of the weights of A_i & A_j, which are 
+        outcome counts unless the space is weighted.
+
+        '''
+        return self._counts
+
+    @property
+    def joint(self):
+        '''Return the matrix of P(A_i & A_j).'''
+        total = self.space.total
+        if numpy is None:
+            return [[c / total for c in row] for row in self._counts]
+        return self._counts / total
+
+    @property
+    def conditional(self):
+        '''Return the matrix of P(A_i | A_j), nan where P(A_j) = 0.'''
+        C = self._counts
+        if numpy is None:
+            return [[c / C[j][j] if C[j][j] else float('nan') 
+                     for j, c in enumerate(row)] for row in C]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return C / C.diagonal()
+
+
+def _quantile(p):
+    '''Return the p-quantile of the standard normal distribution.'''
+    lo, hi = -40.0, 40.0
+    for i in range(100):
+        z = (lo + hi) / 2
+        if 0.5 * (1 + math.erf(z / math.sqrt(2))) < p:
+            lo = z
+        else:
+            hi = z
+    return (lo + hi) / 2
+
+
+def _wilson(k, n, z):
+    '''Return the Wilson score interval for k successes in n trials.'''
+    if not n:
+        return 0.0, 1.0
+    p = k / float(n)
+    d = 1 + z * z / n
+    c = (p + z * z / (2.0 * n)) / d
+    h = z * math.sqrt(p * (1 - p) / n + z * z / (4.0 * n * n)) / d
+    return max(c - h, 0.0), min(c + h, 1.0)
+
+
+def _test(event):
+    '''Return the membership test of an event or predicate.'''
+    return event if callable(event) else event.__contains__
+
+
+def _count(samples, event, given):
+    '''Return (number of samples in given, number in given and event).'''
+    f = _test(event)
+    g = None if given is None else _test(given)
+    n = k = 0
+    for x in samples:
+        if g is None or g(x):
+            n += 1
+            if f(x):
+                k += 1
+    return n, k
+
+
+def _sample_chunk(task):
+    '''
+    Draw count outcomes of space with a generator seeded by seed and 
+    return their `_count`.  Weighted draws bisect the cumulative 
+    weights.
+
+    '''
+    space, cumulative, event, given, count, seed = task
+    rng = random.Random(seed)
+    if cumulative is None:
+        size = getattr(space, 'size', None) or len(space)
+        samples = (space[rng.randrange(size)] for i in range(count))
+    else:
+        total = cumulative[-1]
+        samples = (space[bisect_right(cumulative, rng.random() * total)] 
+                   for i in range(count))
+    return _count(samples, event, given)
+
+
+def _count_chunk(task):
+    samples, event, given = task
+    return _count(samples, event, given)
+
+
+class SampledSpace(object):
+    '''
+    Representation of a sample space too large to count, whose 
+    probabilities are estimated by Monte Carlo sampling.
+
+    The space may be anything that supports `len` and indexing, such 
+    as a CartesianProduct or a PowerSet, in which case outcomes are 
+    drawn uniformly at random (or in proportion to a sequence of 
+    weights).  Any other finite iterable is reservoir sampled in a 
+    single pass.  Events are collections of outcomes or predicates.
+
+    The samples are split into chunks of `chunk` draws, and chunk i 
+    draws from its own generator seeded with (seed, i), so results 
+    depend only on the seed and are the same whether the chunks run 
+    in this process or across a pool of the given number of 
+    processes.  Events and spaces must then be picklable, so 
+    predicates should be module-level functions.
+
+    '''
+    def __init__(self, space, samples=10000, seed=0, processes=None, 
+                 chunk=10000, weights=None, confidence=0.95):
+        self.space = space
+        self.samples = samples
+        self.seed = seed
+        self.processes = processes
+        self.chunk = chunk
+        self.confidence = confidence
+        self.cumulative = None
+        if weights is not None:
+            self.cumulative, total = [], 0.0
+            for w in weights:
+                total += w
+                self.cumulative.append(total)
+
+    def __call__(self, event, given=None):
+        return self.estimate(event, given)[0]
+
+    def _seed(self, i):
+        return self.seed * 2 ** 32 + i
+
+    def _map(self, f, tasks):
+        if not self.processes:
+            return [f(t) for t in tasks]
+        from multiprocessing import Pool
+        pool = Pool(self.processes)
+        try:
+            return pool.map(f, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _sizes(self):
+        return [min(self.chunk, self.samples - i) 
+                for i in range(0, self.samples, self.chunk)]
+
+    def estimate(self, event, given=None):
+        '''
+        Return (p, low, high): an estimate of P(event), or of 
+        P(event | given), and its confidence interval.  The estimate 
+        is nan if no sampled outcome was in given.
+
+        '''
+        space, sizes = self.space, self._sizes()
+        if hasattr(space, '__getitem__') and hasattr(space, '__len__'):
+            tasks = [(space, self.cumulative, event, given, count, self._seed(i)) 
+                     for i, count in enumerate(sizes)]
+            counts = self._map(_sample_chunk, tasks)
+        else:
+            samples = self.reservoir()
+            tasks = [(samples[i:i + self.chunk], event, given) 
+                     for i in range(0, len(samples), self.chunk)]
+            counts = self._map(_count_chunk, tasks)
+        n = sum(c[0] for c in counts)
+        k = sum(c[1] for c in counts)
+        low, high = _wilson(k, n, _quantile(0.5 + self.confidence / 2))
+        return (k / float(n) if n else float('nan')), low, high
+
+    def reservoir(self):
+        '''
+        Return a uniform random sample of `samples` outcomes of the 
+        space, drawn without replacement in one pass over it.
+
+        '''
+        rng, sample = random.Random(self._seed(0)), []
+        for i, x in enumerate(self.space):
+            if i < self.samples:
+                sample.append(x)
+            else:
+                j = rng.randint(0, i)
+                if j < self.samples:
+                    sample[j] = x
+        return sample
 
 
 if __name__ == '__main__':
@@ -1,6 +1,13 @@
+import copy
+import pickle
 from ..sets import *
 from nose.tools import with_setup
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 A, B, C, U = None, None, None, None
 
 def base_sets():
@@ -46,6 +53,59 @@ def test_nested():
     assert Y in Z
     assert not Z in Z
 
+def test_membership():
+    '''Testing hashed membership'''
+    X = Set(range(10**5))
+    assert 0 in X
+    assert 99999 in X
+    assert 10**5 not in X
+    X.add(10**5)
+    assert 10**5 in X
+    X.remove(0)
+    assert 0 not in X
+
+    Y = Set([['a', 'b'], ('c', ['d']), {'e': 1}])
+    assert ['b', 'a'] in Y
+    assert Set(['a', 'b']) in Y
+    assert ('c', Set(['d'])) in Y
+    assert {'e': 1} in Y
+    assert ['a'] not in Y
+    assert len(Set([['a'], Set(['a']), ['a', 'a']])) == 1
+
+@with_setup(base_sets)
+def test_frozen():
+    '''Testing FrozenSets'''
+    F = FrozenSet(A)
+    assert F == A
+    assert A == F
+    assert F == FrozenSet(['c', 'b', 'a', 'a'])
+    assert F != FrozenSet(B)
+    assert hash(F) == hash(FrozenSet(['c', 'b', 'a']))
+    assert F in set([FrozenSet(['a', 'b', 'c'])])
+    assert ['a', 'b', 'c'] in Set([F, FrozenSet(B)])
+    assert F in Set([A, B])
+    for mutate in (lambda: F.add('d'), lambda: F.append('d'),
+                   lambda: F.remove('a'), lambda: F.extend(B),
+                   lambda: F.discard('a'), lambda: F.update(B)):
+        try:
+            mutate()
+        except TypeError:
+            pass
+        else:
+            assert False, 'FrozenSet was mutated'
+    assert F == A
+    assert F | B == A | B
+    assert all(type(S) is FrozenSet for S in A.powergen(frozen=True))
+    assert list(A.powergen(frozen=True)) == list(A.powergen())
+    assert F != 5 and F != ~Set(['b']) and not F != A
+    P = Relation([(1, 2), (3, 3)]).equivalence_classes
+    for clone in (copy.copy, copy.deepcopy, 
+                  lambda X: pickle.loads(pickle.dumps(X, 2))):
+        G = clone(F)
+        assert type(G) is FrozenSet and G == F and hash(G) == hash(F)
+        Q = clone(P)
+        assert Q == [[1, 2], [3]] and all(type(S) is FrozenSet for S in Q)
+
 @with_setup(base_sets)
 def test_union():
     '''Testing union method'''
@@ -62,6 +122,75 @@ def test_union():
     assert A.union(B, X) == ['a', 'b', 'c', 'd', 'e', 'x']
     assert A | B | X == ['a', 'b', 'c', 'd', 'e', 'x']
 
+def test_merges():
+    '''Testing sorted merges and their hashed fallbacks'''
+    X = Set(range(0, 10**5, 2))
+    Y = Set(range(0, 10**5, 3))
+    Z = Set(range(0, 10**5, 5))
+    assert X | Y | Z == X.union(Y, Z)
+    assert len(X | Y | Z) == len(set(X) | set(Y) | set(Z))
+    assert X & Y == Set(range(0, 10**5, 6))
+    assert len(X - Y) == len(set(X) - set(Y))
+    assert len(X ^ Y) == len(set(X) ^ set(Y))
+    assert list(X | Y) == sorted(set(X) | set(Y))
+
+    S = Set([Set([1]), Set([1, 2])])
+    T = Set([Set([1, 2]), Set([3])])
+    assert S | T == [[1], [1, 2], [3]]
+    assert S & T == [[1, 2]]
+    assert S - T == [[1]]
+    assert S ^ T == [[1], [3]]
+    assert Set([1, 2]) | Set(['a']) == [1, 2, 'a']
+    assert Set([1, 2]) - [2] == [1]
+
+@with_setup(base_sets)
+def test_mutation():
+    '''Testing in-place mutation'''
+    X = Set([5, 1, 3])
+    X.add(2)
+    X.add(6)
+    X.add(0)
+    X.add(3)
+    assert list(X) == [0, 1, 2, 3, 5, 6]
+    X.discard(3)
+    X.discard(4)
+    assert list(X) == [0, 1, 2, 5, 6]
+    assert 3 not in X and 2 in X
+    Y = X
+    X.update([9, 4], Set([7]))
+    assert X is Y
+    assert list(X) == [0, 1, 2, 4, 5, 6, 7, 9]
+    X |= range(20)
+    assert X is Y
+    assert list(X) == range(20)
+    X &= range(5, 50)
+    assert list(X) == range(5, 20)
+    X -= range(10, 50)
+    assert list(X) == range(5, 10)
+    X ^= [8, 9, 10]
+    assert X is Y
+    assert list(X) == [5, 6, 7, 10]
+    assert 10 in X and 9 not in X
+    n = 10**5
+    X = Set(range(0, 2 * n, 2))
+    X.update(range(1, n // 5, 2))
+    assert len(X) == n + n // 10
+    assert X[:6] == [0, 1, 2, 3, 4, 5] and X[-1] == 2 * n - 2
+    assert n // 5 - 1 in X and n // 5 + 1 not in X
+
+    S = Set([A])
+    S.add(['c', 'b', 'a'])
+    S.add(B)
+    assert len(S) == 2
+    S.discard(['a', 'b', 'c'])
+    assert S == [B]
+    S |= [A, C]
+    S &= [A, B]
+    S ^= [C]
+    assert S == [A, B, C]
+    S -= Set([B])
+    assert S == [A, C]
+
 @with_setup(base_sets)
 def test_intersect():
     '''Testing intersect method'''
@@ -76,6 +205,15 @@ def test_intersect():
     assert A.intersect(B, C) == []
     assert A & B & C == []
 
+    X = Set(['x', 'y'])
+    assert A.intersect(A, A) == A
+    assert A.intersect(B, A) == ['c']
+    assert (A | B | C).intersect(B, C, ['d', 'e', 'x']) == ['d', 'e']
+    assert A.intersect(X, B, C) == []
+
+    S = [Set(range(i, 10**4 + i)) for i in range(10)]
+    assert S[0].intersect(*S[1:]) == Set(range(9, 10**4))
+
 @with_setup(base_sets)
 def test_powerset():
     '''Testing powerset method'''
@@ -98,6 +236,24 @@ def test_powerset():
                  Set(['c'])]
     for a, b in zip(A.powergen(), A.powerset()): assert a == b
 
+    X = Set(range(100))
+    P = X.powerset()
+    assert P.size == 2**100
+    assert Set([0, 50, 99]) in P
+    assert [1, 2, 3] in P
+    assert [1, 100] not in P
+    assert P.rank([0, 2]) == 5
+    assert P.unrank(5) == [0, 2]
+    assert P[-1] == X
+    assert P.unrank(P.rank([3, 7], gray=True), gray=True) == [3, 7]
+
+    P = A.powerset()
+    G = list(P.gray())
+    assert len(Set(G)) == len(P)
+    assert all(len(a ^ b) == 1 for a, b in zip(G, G[1:]))
+    assert all(P.rank(S, gray=True) == i for i, S in enumerate(G))
+    assert [S.set for S in P] == list(A.powergen())
+
 @with_setup(base_sets)
 def test_product():
     '''Testing product method'''
@@ -110,6 +266,37 @@ def test_product():
     assert ('c', 'e') in X
     assert ('a', 'a') not in X
 
+    assert X == X.relation
+    assert X.relation == X
+    assert list(X) == X.relation
+    assert [X[i] for i in range(len(X))] == list(X.relation)
+    assert X[-1] == ('c', 'e')
+
+    X = Set(range(10**4))
+    Y = X * X
+    assert len(Y) == 10**8
+    assert (9999, 0) in Y
+    assert (0, 10**4) not in Y
+    assert Y[10**4 + 1] == (1, 1)
+    assert 5/Y == X and 10**4/Y == []
+    assert 'a'/(A * B) == B and 'd'/(A * B) == []
+    assert A/(A * B) == (A * B).relation.equivalence_classes
+
+    Z = A.product(B, C)
+    assert len(Z) == 27
+    assert ('a', 'c', 'e') in Z
+    assert ('a', 'c') not in Z
+    assert list(Z)[5] == Z[5]
+    try:
+        Z.relation
+    except ValueError:
+        pass
+    else:
+        assert False, 'ternary product made a Relation'
+    E = Set([1]) * Set()
+    assert E == Set([2]) * Set() and E == Set().product(A, B) and not E != Set() * A
+    assert E == [] and Set([1]) * Set([2]) != Set([1]) * Set([3])
+
 @with_setup(base_sets)
 def test_containment():
     '''Testing issubset and issuperset methods'''
@@ -124,6 +311,21 @@ def test_containment():
     assert not A.issuperset(A, proper=True)
     assert not A > A
 
+    assert A == ['c', 'a', 'b', 'a']
+    assert A.equals(['a', 'b', 'c'])
+    assert A.issubset(['a', 'b', 'c', 'c'])
+    assert not A.issubset(['a', 'b', 'c', 'c'], proper=True)
+    assert not A == 'a'
+    X = Set(range(10**5))
+    Y = Set(reversed(range(10**5)))
+    assert X == Y
+    assert X == list(Y)
+    assert X != Y - [0]
+    assert (X - [0]) < Y
+    assert X >= Set(range(0, 10**5, 7))
+    assert not X >= Set(range(0, 10**5 + 7, 7))
+    assert Set([[1], [2]]) == [[2], [1], [2]]
+
     S = Set(['a', 'b', 'c', 'd'])
     assert not A.equals(S)
     assert A != S
@@ -155,6 +357,10 @@ def test_difference():
 
     assert A - C == ['b', 'c']
     assert C - A == ['d', 'e']
+    assert A - ['c', 'x'] == ['a', 'b']
+    assert A - (x for x in 'ab') == ['c']
+    n = 10**5
+    assert Set(range(n)) - list(range(0, n, 2)) == range(1, n, 2)
 
 @with_setup(base_sets)
 def test_sym_diff():
@@ -192,6 +398,74 @@ def test_universe():
     assert NOT - (NOT-A) == A
     assert NOT - (NOT - (NOT-A)) == NOT-A
 
+@with_setup(base_sets)
+def test_cofinite():
+    '''Testing mixed boolean algebra of Sets and Universes'''
+    assert A | ~B == ~(B - A)
+    assert A & ~B == A - B == ['a', 'b']
+    assert A - ~B == A & B == ['c']
+    assert A ^ ~B == ~(A ^ B)
+    assert ~A ^ ~B == A ^ B
+    assert ~A - ~B == B - A
+    assert ~A | ~B == ~(A & B)
+    assert A.union(B, ~C) == ~Set()
+    assert A.intersect(~B, ~C) == ['b']
+    assert A.isdisjoint(~A) and not A.isdisjoint(~B)
+    assert A <= ~(B - A) and not A <= ~B
+    assert ~A <= ~Set(['a']) and ~A < ~Set(['a']) and not ~A < ~A
+    assert ~A >= Set(['x', 'y']) and not ~A >= B
+    assert not A >= ~B and not ~A <= B
+    assert ~A != A and ~A != ~B and ~A == ~Set(['c', 'b', 'a'])
+    assert ['a', 'x'] - ~A == ['a']
+
+    X = ~A
+    D = X._diff
+    X |= ['a', 'x']
+    X -= ['d']
+    X &= ~Set(['e'])
+    X ^= ['b', 'f']
+    X.add('c')
+    X.discard('g')
+    assert X._diff is D
+    assert X == ~Set(['d', 'e', 'f', 'g'])
+    X &= ['a', 'd', 'x']
+    assert X == ['a', 'x']
+
+    S = Set(['a', 'b'])
+    S &= ~Set(['b'])
+    assert S == ['a']
+    S -= ~Set(['a', 'z'])
+    assert S == ['a']
+    S |= ~Set(['a', 'z'])
+    assert S == ~Set(['z'])
+
+    n = 10**5
+    X = ~Set(range(n))
+    assert 0 not in X and n in X and -1 in X
+    assert ~X == range(n)
+    assert (X & range(n - 5, n + 5)) == range(n, n + 5)
+
+@with_setup(base_sets)
+def test_expressions():
+    '''Testing deferred set expressions'''
+    D = Set(['b', 'x'])
+    E = (A.lazy() | B) & C - D
+    assert isinstance(E, Expression)
+    assert 'a' in E and 'b' not in E and 'c' not in E
+    assert E.evaluate() == (A | B) & C - D == ['a', 'd', 'e']
+    assert (A ^ B.lazy()).evaluate() == A ^ B
+    assert (~(A.lazy() | B)).evaluate() == ~A & ~B
+    assert (~A.lazy() - ~B).evaluate() == B - A
+    assert (U.lazy() - A & ~B).evaluate() == ~(A | B)
+    assert (~(~A.lazy() ^ B) | C).evaluate() == ~(~A ^ B) | C
+    assert (A - (B - C.lazy())).evaluate() == A - (B - C)
+    assert (D - A.lazy()).evaluate() == ['x']
+    assert (~A - (D.lazy() & ~B)).evaluate() == ~A - (D & ~B)
+
+    n = 10**5
+    X, Y, Z = Set(range(n)), Set(range(0, 2 * n, 2)), Set(range(0, n, 5))
+    assert ((X.lazy() & Y & Z) - Set([0])).evaluate() == range(10, n, 10)
+
 @with_setup(base_sets)
 def test_complements():
     '''Testing complementation with __invert__ method'''
@@ -242,7 +516,7 @@ def test_relation():
     assert R.transitive
     assert R.antisymmetric
     assert R.partial_order
-    assert not R.total_order
+    assert R.total_order
 
 def test_relations():
     '''Testing Relations'''
@@ -358,6 +632,219 @@ def test_relations():
     assert b.next() == c
     assert c.next() == None
 
+def test_adjacency():
+    '''Testing Relation queries after mutation'''
+    R = Relation([(1, 2), (1, 3), (2, 3)])
+    assert R.successors(1) == [2, 3]
+    assert R.predecessors(3) == [1, 2]
+    assert R.domain == [1, 2]
+    assert R.range == [2, 3]
+    assert R.element(4) is None
+    R.append((3, 4))
+    assert R.successors(3) == [4]
+    assert R.range == [2, 3, 4]
+    assert R.element(4) == 4
+    R.add((4, 4))
+    assert R.successors(4) == [4]
+    assert R.successors(4, strict=True) == []
+    R.discard((1, 2))
+    assert R.predecessors(2) == []
+    assert R.domain == [1, 2, 3, 4]
+    assert R.maximals == Set([4])
+    assert R.minimals == Set([1, 2])
+
+    R = Relation([(['a'], ['a', 'b']), (['b'], ['a', 'b'])])
+    assert R.predecessors(Set(['b', 'a'])) == [['a'], ['b']]
+    assert R.successors(['a']) == [['a', 'b']]
+
+def test_dense_relations():
+    '''Testing property checks on dense relations'''
+    for n in (5, 50):
+        X = Set(range(n))
+        R = X.relation(lambda a, b: a <= b)
+        assert R._matrix() is not None or numpy is None
+        assert R.reflexive and R.antisymmetric and R.transitive
+        assert R.comparable and R.total_order
+        assert not R.symmetric
+        R = X.relation(lambda a, b: a % 3 == b % 3)
+        assert R.reflexive and R.symmetric and R.transitive
+        assert not R.antisymmetric
+        assert not R.comparable
+        R = X.relation(lambda a, b: a < b or a == b == 0)
+        assert not R.reflexive
+        assert R.transitive
+        R = X.relation(lambda a, b: b == a + 1 or a == b)
+        assert not R.transitive
+        assert R.antisymmetric
+
+def test_closures():
+    '''Testing closures of relations'''
+    R = Relation([(1, 2), (2, 3), (3, 4)])
+    assert not R.transitive
+    T = R.transitive_closure
+    assert T.transitive
+    assert T == [(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)]
+    assert R.reflexive_closure == R | [(1, 1), (2, 2), (3, 3), (4, 4)]
+    assert R.symmetric_closure == R | R.inverse
+    assert R.symmetric_closure.symmetric
+
+    C = Relation([(1, 2), (2, 1), (2, 3), (4, 4)])
+    T = C.transitive_closure
+    assert T.transitive
+    assert T == [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3), (4, 4)]
+    assert (3, 3) not in T
+
+    E = Relation([('a', 'b'), ('c', 'b'), ('d', 'e')]).equivalence_closure
+    assert E.reflexive and E.symmetric and E.transitive
+    assert E.equivalence_classes == [['a', 'b', 'c'], ['d', 'e']]
+
+    R = Relation([(i, i + 1 if i % 100 != 99 else i - 99) 
+                  for i in range(10**4)])
+    assert len(R.transitive_closure) == 10**4 * 100
+
+def test_hasse():
+    '''Testing covers and transitive reduction'''
+    X = Set([1, 2, 3, 4, 6, 12])
+    R = X.relation(lambda a, b: b % a == 0)
+    assert R.partial_order
+    assert R.covers(12) == [4, 6]
+    assert R.covers(6) == [2, 3]
+    assert R.covers(1) == []
+    assert R.covered_by(1) == [2, 3]
+    assert R.covered_by(12) == []
+    assert R.covers(5) == []
+    assert R.transitive_reduction == [(1, 2), (1, 3), (2, 4), (2, 6), 
+                                      (3, 6), (4, 12), (6, 12)]
+    assert R.transitive_reduction.transitive_closure.reflexive_closure == R
+    twelve = R.element(12)
+    assert twelve.immediate_predecessors() == [4, 6]
+    assert twelve.prev() in (4, 6)
+    assert R.element(1).next() in (2, 3)
+
+    R = Set(range(500)).relation(lambda a, b: a <= b)
+    assert R.covers(250) == [249]
+    assert R.element(0).next() == 1
+    assert len(R.transitive_reduction) == 499
+
+def test_posets():
+    '''Testing Posets'''
+    X = Set([1, 2, 3, 4, 6, 12])
+    P = Poset(X.relation(lambda a, b: b % a == 0))
+    assert P.partial_order
+    assert P.le(1, 12) and P.le(2, 2) and P.lt(2, 6)
+    assert not P.le(4, 6) and not P.lt(2, 2) and not P.le(12, 1)
+    assert not P.le(5, 5)
+    assert P.upset(2) == [2, 4, 6, 12]
+    assert P.upset(2, strict=True) == [4, 6, 12]
+    assert P.downset(6) == [1, 2, 3, 6]
+    assert P.downset(6, strict=True) == [1, 2, 3]
+    assert P.between(1, 12, strict=True) == [2, 3, 4, 6]
+    assert P.between(2, 12) == [2, 4, 6, 12]
+    assert P.between(4, 6) == []
+
+    a, b, c, d = [P.element(x) for x in (2, 4, 6, 12)]
+    assert a < b < d
+    assert not b <= c
+    assert c.between(a, d)
+    assert not c.between(b, d)
+    assert d.predecessors() == [1, 2, 3, 4, 6]
+    assert a.successors() == [4, 6, 12]
+
+    P = Poset([(i, i + 1) for i in range(1000)])
+    assert P.le(0, 1000)
+    assert not P.le(1000, 0)
+    assert P.between(10, 20) == range(10, 21)
+    assert len(P.upset(500)) == 501
+    assert P.first == 0 and P.last == 1000
+    assert P.partial_order and P.total_order and not P.transitive
+    a, c = P.element(0), P.element(2)
+    assert a < c and c.predecessors() == [0, 1] == P.downset(2, strict=True)
+    assert a.successors() == P.upset(0, strict=True)
+    assert P.predecessors(2) == [0, 1, 2] and P.successors(999) == [999, 1000]
+    assert not Poset([(1, 2), (2, 1)]).partial_order
+    assert not Poset(X.relation(lambda a, b: b % a == 0)).total_order
+    assert Poset(X.relation(lambda a, b: b % a == 0 and a > 1)).first == None
+
+def test_extremal():
+    '''Testing first, last, maximal and minimal elements'''
+    n = 10**4
+    R = Relation([(i, i) for i in range(n)] + [(0, i) for i in range(1, n)])
+    assert R.first == 0 and R.last == None
+    assert R.minimals == [0]
+    assert R.maximals == range(1, n)
+    R.maximals.add(-1)
+    assert -1 not in R.maximals
+    R.update([(i, n - 1) for i in range(n - 1)])
+    assert R.last == n - 1
+    assert R.maximals == [n - 1]
+    R.discard((0, 0))
+    assert R.first == None and R.minimals == [0]
+    E = ['x', 'ab', 'b', 'zz', 'q']
+    R = Relation([(x, y) for x in E for y in E])
+    assert R.first == 'ab' and R.last == 'ab'
+
+def test_relation_algebra():
+    '''Testing composition, images and restrictions'''
+    R = Relation([(1, 'a'), (2, 'b'), (3, 'b')])
+    S = Relation([('a', 'x'), ('b', 'y'), ('b', 'z')])
+    assert S.compose(R) == [(1, 'x'), (2, 'y'), (2, 'z'), (3, 'y'), (3, 'z')]
+    assert R.compose(S) == []
+    assert R.inverse.compose(R) == [(1, 1), (2, 2), (2, 3), (3, 2), (3, 3)]
+    assert R.image([1, 2]) == ['a', 'b']
+    assert R.image([4]) == []
+    assert S.preimage(['y', 'x']) == ['a', 'b']
+    assert R.restrict([2, 3, 4]) == [(2, 'b'), (3, 'b')]
+    assert R.corestrict(['a']) == [(1, 'a')]
+    assert type(R.inverse) is Relation
+    assert R.inverse.inverse == R
+
+    n = 10**5
+    R = Relation([(i, i + 1) for i in range(n)])
+    assert len(R.compose(R).compose(R)) == n - 2
+    assert R.compose(R).image([0]) == [2]
+
+def test_compact_relations():
+    '''Testing columnar relations and their loaders'''
+    pairs = [(3, 1), (1, 2), (3, 1), (2, 2), (1, 3)]
+    C = CompactRelation(pairs)
+    R = Relation(pairs)
+    assert len(C) == 4
+    assert list(C) == list(R)
+    assert C == R and C.relation == R
+    assert (3, 1) in C and (2, 2) in C
+    assert (2, 1) not in C and (4, 1) not in C and 'x' not in C
+    assert C.successors(1) == [2, 3]
+    assert C.successors(2, strict=True) == []
+    assert C.predecessors(2) == [1, 2]
+    assert C.domain == [1, 2, 3] and C.range == [1, 2, 3]
+    assert C.inverse == R.inverse and C.inverse.inverse is C
+
+    C = CompactRelation([(['a'], 'b'), ('b', ['a']), (['a'], 'b')])
+    assert len(C) == 2
+    assert (Set(['a']), 'b') in C
+    assert C.successors(['a']) == ['b']
+
+    from StringIO import StringIO
+    f = StringIO('a\tb\nb\tc\n\na\tb\n')
+    assert CompactRelation.from_csv(f, '\t') == [('a', 'b'), ('b', 'c')]
+    f = StringIO('1,2\n2,3\n')
+    C = CompactRelation.from_csv(f, convert=int)
+    assert C == [(1, 2), (2, 3)]
+    assert (1, 2) in C and (1.0, 2) in C and ('1', '2') not in C
+    assert C.successors(2) == [3] and C.predecessors(2) == [1]
+    f = StringIO('1,2\n2,3\n')
+    C = CompactRelation.from_csv(f, convert=lambda x: [x])
+    assert (['1'], ['2']) in C and C.successors(['2']) == [['3']]
+
+    n = 10**5
+    C = CompactRelation.from_arrays(range(n), [i % 7 for i in range(n)])
+    assert len(C) == n
+    assert C.predecessors(6) == range(6, n, 7)
+    C = CompactRelation.from_arrays(['x', 'y', 'x'], ['z', 'x', 'z'])
+    assert C == [('x', 'z'), ('y', 'x')]
+    C = CompactRelation.from_arrays([0, 1, 1], [1, 0, 0], members='ab')
+    assert C == [('a', 'b'), ('b', 'a')]
+
 def test_equivalence_rels():
     '''Testing equivalence relations'''
     R = Relation([('a', 'a'), ('b', 'b'), ('c', 'c'), 
@@ -367,6 +854,8 @@ def test_equivalence_rels():
                   ('d', 'e'), ('e', 'd')])
 
     assert R.equivalence_classes == [['a', 'b', 'c'], ['d', 'e']]
+    P = Relation([('d', 'a'), ('b', 'c')]).equivalence_classes
+    assert [list(S) for S in P] == [['a', 'd'], ['b', 'c']]
 
 def test_partitions():
     '''Testing Partitions'''
@@ -393,6 +882,84 @@ def test_partitions():
     assert X/R == [['a', 'b', 'c'], ['d', 'e']]
     assert R.equivalence_classes == [['a', 'b', 'c'], ['d', 'e']]
     assert 'a'/(X * X) == X, 'X is only equiv class'
+    assert all(type(S) is FrozenSet for S in C)
+    assert all(type(S) is FrozenSet for S in R.equivalence_classes)
+
+    assert type(R.equivalence_classes) is Partition
+    assert C.block('b') == ['a', 'b', 'c']
+    assert C.block('x') is None
+    assert C.labels['a'] == C.labels['c'] != C.labels['d']
+    assert Set(['a', 'b', 'c']) / C is None
+
+    R = Relation([(i, i - i % 10 + j) for i in range(10**4) for j in range(10)])
+    C = R.equivalence_classes
+    assert len(C) == 10**3
+    assert C.block(1234) == range(1230, 1240)
+    assert R == Set(range(10**4)) / C
+
+    E = Partition([Set(range(10**4)), Set(['x'])]).equivalence_relation
+    assert len(E) == 10**8 + 1
+    assert (0, 9999) in E
+    assert ('x', 'x') in E
+    assert (0, 'x') not in E
+    assert (0, 10**4) not in E
+    assert E.reflexive and E.symmetric and E.transitive
+    assert not E.antisymmetric and not E.comparable
+    assert 5/E == range(10**4)
+    assert 'x'/E == ['x']
+
+    E = Partition([Set(['a', 'b'])]).equivalence_relation
+    assert E.comparable and not E.antisymmetric
+    assert not E.total_order and not E.relation.total_order
+    E = Partition([Set(['a'])]).equivalence_relation
+    assert E.total_order and E.relation.total_order
+
+def test_bitsets():
+    '''Testing BitSets over a Ground'''
+    G = Ground('abcdef')
+    A = G.subset(['a', 'b', 'c'])
+    B = G.subset(['c', 'd', 'e'])
+    assert len(G) == 6
+    assert len(A) == 3
+    assert 'a' in A
+    assert 'd' not in A
+    assert 'x' not in A
+    assert A & B == ['c']
+    assert A | B == ['a', 'b', 'c', 'd', 'e']
+    assert A - B == ['a', 'b']
+    assert A ^ B == ['a', 'b', 'd', 'e']
+    assert ~A == ['d', 'e', 'f']
+    assert A & B <= A
+    assert A & B < A
+    assert not A <= B
+    assert A.isdisjoint(~A)
+    assert (A | B).set == Set(['a', 'b', 'c', 'd', 'e'])
+    assert type((A | B).set) is Set
+    assert Set(['c', 'b', 'a']).bitset(G) == A
+    assert A & Set(['a', 'f']) == ['a']
+    assert Set(range(100)).bitset() == range(100)
+    assert G.mask([]) == 0 and G.mask('af') == 0b100001
+    assert Ground([]).mask([]) == 0
+
+    H = Ground('cdexyz')
+    C = H.subset(['c', 'd', 'e'])
+    assert C == B and B == C and not C == A and C != A
+    assert A & C == ['c'] and C & Set(['d']) == ['d']
+    assert len(Set([B, C])) == 1
+    X, Y = Set('ab').powerset(), Set('bc').powerset()
+    assert X[2] == Y[1] and X[1] != Y[1]
+    assert len(X.set | Y.set) == 6
+    assert A <= Set('abcx') and A < Set('abcx') and not A < Set('abc')
+    assert not A >= Set('ax') and A.isdisjoint(['x', 'f'])
+    assert A & ['x'] == [] and A & ['a', 'x'] == ['a'] and ['x', 'b'] & A == ['b']
+    assert A - ['x'] == A and A - ['a', 'x'] == ['b', 'c'] and A - C == ['a', 'b']
+    for combine in (lambda: A | ['x'], lambda: A ^ ['x'], lambda: ['x'] - A):
+        try:
+            combine()
+        except KeyError:
+            pass
+        else:
+            assert False, 'BitSet held a member outside its ground'
 
 def test_sample_space():
     '''Testing SampleSpace probability'''
@@ -410,3 +977,105 @@ def test_sample_space():
     assert P(A, given=B) == 0.5
     assert P(A, given=C) == 0.0
     assert P(A & B) == P(A, given=B) * P(B)
+
+    E, F = P.event(A), P.event(B)
+    assert P(E) == P(A)
+    assert P(E, given=F) == P(A, given=B)
+    assert P(E & F) == P(A & B)
+
+def test_batch_probability():
+    '''Testing batch and weighted SampleSpace queries'''
+    A = Set(['a', 'b', 'c'])
+    B = Set(['c', 'd'])
+    C = Set(['d', 'e', 'f'])
+    P = SampleSpace(A, B, C)
+    assert P.batch([A, B, C, A]) == [P(A), P(B), P(C), P(A)]
+    assert P.batch([A, C], given=B) == [P(A, given=B), P(C, given=B)]
+    assert P.conditional([(A, B), (C, A), (B, C)]) == [0.5, 0.0, 1 / 3.0]
+    assert P.joint([(A, B), (A, C)]) == [P(A & B), P(A & C)]
+
+    W = SampleSpace(A, B, C, weights=dict(a=4, b=1, c=1, d=2, e=1, f=1))
+    assert W(A) == 0.6
+    assert W(B) == 0.3
+    assert W(A, given=B) == 1 / 3.0
+    assert W.joint([(A, B)]) == [W(A & B)] == [0.1]
+    assert W(W.event(['a', 'f'])) == 0.5
+
+    n = 1000
+    P = SampleSpace(Set(range(n)), weights=dict((i, i % 2) for i in range(n)))
+    events = [P.event(range(i, n)) for i in range(0, n, 10)]
+    evens, odds = P.event(range(0, n, 2)), P.event(range(1, n, 2))
+    assert P.batch(events)[50] == 0.5
+    assert P.batch([evens, odds]) == [0.0, 1.0]
+    assert P.conditional([(e, odds) for e in events])[:2] == [1.0, 0.99]
+
+    masks = range(0, 2 ** 12 * 5000, 2 ** 12)
+    P = SampleSpace(Set(range(26)), weights=dict((i, 1) for i in range(26)))
+    p = P.batch([BitSet(P.ground, m) for m in masks])
+    assert p == [bin(m).count('1') / 26.0 for m in masks]
+    assert len(P._measures) < len(masks)
+
+def test_event_family():
+    '''Testing pairwise probabilities over a family of events'''
+    A = Set(['a', 'b', 'c'])
+    B = Set(['c', 'd'])
+    C = Set(['d', 'e', 'f'])
+    for P in (SampleSpace(A, B, C), 
+              SampleSpace(A, B, C, weights=dict(a=4, b=1, c=1, d=2, e=1, f=1))):
+        F = P.family([A, B])
+        F.add(C, lambda x: x in 'aeiou')
+        events = [A, B, C, Set(['a', 'e'])]
+        assert len(F) == 4
+        for i, X in enumerate(events):
+            for j, Y in enumerate(events):
+                assert abs(F.joint[i][j] - P(X & Y)) < 1e-12
+                assert abs(F.conditional[i][j] - P(X, given=Y)) < 1e-12
+        assert F.counts[0][0] == P(A) * P.total
+    F = P.family([A, []])
+    assert F.conditional[0][1] != F.conditional[0][1]
+
+    n = 10**5
+    P = SampleSpace(Set(range(n)))
+    F = P.family([range(0, n, k) for k in range(1, 11)])
+    assert F.counts[1][2] == len(range(0, n, 6))
+    assert F.conditional[3][1] == 0.5
+
+def odd_sum(t):
+    return sum(t) % 2 == 1
+
+def test_sampled_space():
+    '''Testing predicate events and Monte Carlo estimates'''
+    A = Set(['a', 'b', 'c'])
+    B = Set(['c', 'd'])
+    C = Set(['d', 'e', 'f'])
+    P = SampleSpace(A, B, C)
+    vowel = lambda x: x in 'aeiou'
+    assert P(vowel) == P(['a', 'e']) == 1 / 3.0
+    assert P(vowel, given=A) == P(A, given=vowel) * P(vowel) / P(A)
+    assert P.event(vowel) == ['a', 'e']
+
+    S = P.sampled(samples=20000, seed=1)
+    p, low, high = S.estimate(A)
+    assert low < 0.5 < high and high - low < 0.03
+    p, low, high = S.estimate(vowel, given=C)
+    assert low < 1 / 3.0 < high
+
+    X = Set(range(10**4))
+    Q = SampledSpace(X.product(X, X), samples=20000, seed=2)
+    assert Q.space.size == 10**12
+    p, low, high = Q.estimate(odd_sum)
+    assert low < 0.5 < high
+    p, low, high = Q.estimate(lambda t: t[0] < 5000, given=odd_sum)
+    assert low < 0.5 < high
+    R = SampledSpace(X.product(X, X), samples=20000, seed=2, chunk=5000, 
+                     processes=2)
+    S = SampledSpace(X.product(X, X), samples=20000, seed=2, chunk=5000)
+    assert R.estimate(odd_sum) == S.estimate(odd_sum)
+
+    R = SampledSpace(iter(range(1000)), samples=100, seed=3)
+    assert len(Set(R.reservoir())) == 100
+    W = SampledSpace('ab', weights=[1, 3], samples=4000)
+    p, low, high = W.estimate(['b'])
+    assert low < 0.75 < high
+    assert SampledSpace(range(10), samples=100).estimate(
+        [1], given=[11])[1:] == (0.0, 1.0)